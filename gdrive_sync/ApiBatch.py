@@ -0,0 +1,69 @@
+from gdrive_sync import utils
+
+logger = utils.create_logger(__name__)
+
+# Google Drive accepts at most 100 calls in a single batch request
+MAX_BATCH_SIZE = 100
+
+
+class ApiBatch:
+    """
+    Accumulates non-media google drive requests (deletes, folder creation etc.)
+    and sends them to the batch endpoint, so that N metadata operations cost
+    one http round-trip instead of N.
+    """
+
+    def __init__(self, service):
+        '''
+        Args:
+            service: A googleapiclient.discovery.Resource object
+        '''
+        self._service = service
+        self._pending = []
+        # The number of failed requests across all the executions
+        self.failure_count = 0
+
+    def add(self, request, callback=None):
+        '''
+        Adds a request to the batch. If the batch is full, it is executed first.
+        Args:
+            request: A googleapiclient.http.HttpRequest object which is not yet executed
+            callback: A function that takes the response of the request as input argument.
+                It is invoked only if the request succeeds.
+        '''
+        if len(self._pending) >= MAX_BATCH_SIZE:
+            self.execute()
+        self._pending.append((request, callback))
+
+    def execute(self):
+        '''
+        Sends all the pending requests in a single batch request and invokes the
+        callbacks of the successful ones. Failed requests are logged and skipped.
+        Returns:
+            A dict of request_id vs response for the successful requests
+        '''
+        if not self._pending:
+            return {}
+        pending, self._pending = self._pending, []
+        callbacks = {}
+        responses = {}
+
+        def on_response(request_id, response, exception):
+            if exception:
+                logger.error('Batched request %s failed: %s', request_id, exception)
+                self.failure_count += 1
+                return
+            responses[request_id] = response
+            if callbacks[request_id]:
+                callbacks[request_id](response)
+
+        batch = self._service.new_batch_http_request(callback=on_response)
+        for index, (request, callback) in enumerate(pending):
+            request_id = str(index)
+            callbacks[request_id] = callback
+            batch.add(request, request_id=request_id)
+        batch.execute()
+        return responses
+
+    def __len__(self):
+        return len(self._pending)
@@ -1,8 +1,13 @@
+import os
 import sqlite3
+import threading
 from gdrive_sync import utils
 
 LOGGER = utils.create_logger(__name__)
 
+# Older sqlite versions allow at most 999 parameters in a statement
+MAX_QUERY_PARAMETERS = 900
+
 
 class _Db_constants:
     FILE_MAPPING_INFO = 'file_mapping_info'
@@ -10,6 +15,9 @@ class _Db_constants:
     REMOTE_ID = 'remote_id'
     LOCAL_MODIFICATION_DATE = 'local_modification_date' 
     REMOTE_MODIFICATION_DATE = 'remote_modification_date'
+    CONTENT_HASH = 'content_hash'
+    SYNC_STATE = 'sync_state'
+    PAGE_TOKEN = 'page_token'
 
 
 class DbHandler:
@@ -19,14 +27,25 @@ class DbHandler:
 
     def __init__(self, db_file_path=None):
         self._db_file_path = db_file_path if db_file_path else '{}/gsync.db'.format(utils.get_gdrive_sync_home())
+        # The dirs are synced from multiple threads, so the writes are serialized
+        self._write_lock = threading.Lock()
 
         def create_db_if_not_present(cursor):
-            cursor.execute('CREATE TABLE IF NOT EXISTS {0} ({1} TEXT, {2} TEXT, {3} INTEGER, {4} INTEGER)'
+            # WAL lets the reads run while a write is in progress
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('CREATE TABLE IF NOT EXISTS {0} ({1} TEXT, {2} TEXT, {3} INTEGER, {4} INTEGER, {5} TEXT)'
                            .format(_Db_constants.FILE_MAPPING_INFO,
                                    _Db_constants.LOCAL_PATH,
                                    _Db_constants.REMOTE_ID,
                                    _Db_constants.LOCAL_MODIFICATION_DATE,
-                                   _Db_constants.REMOTE_MODIFICATION_DATE))
+                                   _Db_constants.REMOTE_MODIFICATION_DATE,
+                                   _Db_constants.CONTENT_HASH))
+            # Dbs created by the older versions do not have the content_hash column
+            cursor.execute('PRAGMA table_info({0})'.format(_Db_constants.FILE_MAPPING_INFO))
+            if _Db_constants.CONTENT_HASH not in [column[1] for column in cursor.fetchall()]:
+                cursor.execute('ALTER TABLE {0} ADD COLUMN {1} TEXT'
+                               .format(_Db_constants.FILE_MAPPING_INFO,
+                                       _Db_constants.CONTENT_HASH))
             cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS {0} on {1}({2})'
                            .format('local_path_index',
                                    _Db_constants.FILE_MAPPING_INFO,
@@ -35,6 +54,10 @@ class DbHandler:
                            .format('remote_id_index',
                                    _Db_constants.FILE_MAPPING_INFO,
                                    _Db_constants.REMOTE_ID))
+            cursor.execute('CREATE TABLE IF NOT EXISTS {0} ({1} TEXT PRIMARY KEY, {2} TEXT)'
+                           .format(_Db_constants.SYNC_STATE,
+                                   _Db_constants.LOCAL_PATH,
+                                   _Db_constants.PAGE_TOKEN))
         self._execute_in_transaction(create_db_if_not_present)
 
     def _execute_in_transaction(self, function):
@@ -43,22 +66,24 @@ class DbHandler:
         Args:
             function: A function that takes cursor as input argument and returns no value.
         '''
-        try:
-            connection = sqlite3.connect(self._db_file_path)
-            cursor = connection.cursor()
-            function(cursor)
-            connection.commit()
-        except Exception:
-            connection.rollback()
-            LOGGER.error('Unable to commit db opearation:', exc_info=True)
-        finally:
-            connection.close()
+        with self._write_lock:
+            try:
+                connection = sqlite3.connect(self._db_file_path)
+                cursor = connection.cursor()
+                function(cursor)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                LOGGER.error('Unable to commit db opearation:', exc_info=True)
+            finally:
+                connection.close()
 
     def insert_record(self, 
                       local_path, 
                       remote_id, 
                       local_modification_date, 
-                      remote_modification_date):
+                      remote_modification_date,
+                      content_hash=None):
         '''
         If no record with local_path exists, inserts the inputs as a record in Db.
         Else updates the existing record.
@@ -67,6 +92,7 @@ class DbHandler:
             remote_id: 'A String'
             local_modification_date: Integer
             remote_modification_date: Integer
+            content_hash: 'A String' md5 checksum of the synced content, None for dirs or if unknown
         '''
         def insert_function(cursor):
             cursor.execute('SELECT 1 FROM {tn} WHERE {cn1}=?'
@@ -74,23 +100,43 @@ class DbHandler:
                                    cn1=_Db_constants.LOCAL_PATH),
                            (local_path,))
             if len(cursor.fetchall()):
-                cursor.execute('UPDATE {tn} SET {cn1}=?, {cn2}=?, {cn3}=? WHERE {cn4}=?'
+                cursor.execute('UPDATE {tn} SET {cn1}=?, {cn2}=?, {cn3}=?, {cn5}=? WHERE {cn4}=?'
                            .format(tn=_Db_constants.FILE_MAPPING_INFO,
                                    cn1=_Db_constants.REMOTE_ID,
                                    cn2=_Db_constants.LOCAL_MODIFICATION_DATE,
                                    cn3=_Db_constants.REMOTE_MODIFICATION_DATE,
-                                   cn4=_Db_constants.LOCAL_PATH),
+                                   cn4=_Db_constants.LOCAL_PATH,
+                                   cn5=_Db_constants.CONTENT_HASH),
                            (remote_id,
                             local_modification_date, 
                             remote_modification_date,
+                            content_hash,
                             local_path))
             else:
-                cursor.execute('INSERT INTO {tn} values(?, ?, ?, ?)'
+                cursor.execute('INSERT INTO {tn} values(?, ?, ?, ?, ?)'
                                .format(tn=_Db_constants.FILE_MAPPING_INFO),
                                (local_path, 
                                 remote_id,
                                 local_modification_date, 
-                                remote_modification_date))
+                                remote_modification_date,
+                                content_hash))
+        self._execute_in_transaction(insert_function)
+
+    def insert_many(self, records):
+        '''
+        Inserts the records in a single transaction. A record with the same local_path
+        or remote_id as an existing one replaces it.
+        Args:
+            records: A list of (local_path, remote_id, local_modification_date, remote_modification_date,
+                content_hash)
+        '''
+        if not records:
+            return
+
+        def insert_function(cursor):
+            cursor.executemany('INSERT OR REPLACE INTO {tn} values(?, ?, ?, ?, ?)'
+                               .format(tn=_Db_constants.FILE_MAPPING_INFO),
+                               records)
         self._execute_in_transaction(insert_function)
 
     def _execute_read_function(self, function):
@@ -153,6 +199,49 @@ class DbHandler:
                 return final_val[0]
         return self._execute_read_function(read_function)
     
+    def get_many_local_paths(self, remote_file_ids):
+        '''
+        Fetches the local_file_paths for the input remote_file_ids from DB in bulk.
+        Args:
+            remote_file_ids: A list of String
+        Returns:
+            A dict of remote_id vs local_path for the remote_file_ids that have records
+        '''
+        remote_file_ids = list(remote_file_ids)
+
+        def read_function(cursor):
+            local_paths = {}
+            for i in range(0, len(remote_file_ids), MAX_QUERY_PARAMETERS):
+                chunk = remote_file_ids[i:i + MAX_QUERY_PARAMETERS]
+                cursor.execute('SELECT {cn1}, {cn2} FROM {tn} WHERE {cn1} IN ({params})'
+                               .format(tn=_Db_constants.FILE_MAPPING_INFO,
+                                       cn1=_Db_constants.REMOTE_ID,
+                                       cn2=_Db_constants.LOCAL_PATH,
+                                       params=', '.join('?' * len(chunk))),
+                               chunk)
+                local_paths.update(cursor.fetchall())
+            return local_paths
+        return self._execute_read_function(read_function) or {}
+
+    def get_local_modification_dates_under(self, local_dir_path):
+        '''
+        Fetches the local modification dates of all the records under the input local dir from Db.
+        Args:
+            local_dir_path: 'A String'
+        Returns:
+            A dict of local_path vs local_modification_date. The local_dir_path itself is not included.
+        '''
+        prefix = os.path.join(local_dir_path, '')
+
+        def read_function(cursor):
+            cursor.execute('SELECT {cn1}, {cn2} FROM {tn} WHERE substr({cn1}, 1, ?)=?'
+                           .format(tn=_Db_constants.FILE_MAPPING_INFO,
+                                   cn1=_Db_constants.LOCAL_PATH,
+                                   cn2=_Db_constants.LOCAL_MODIFICATION_DATE),
+                           (len(prefix), prefix))
+            return dict(cursor.fetchall())
+        return self._execute_read_function(read_function) or {}
+
     def get_local_modification_date(self, local_file_path):
         '''
         Fetches the local modification date for the input local file path from Db.
@@ -233,4 +322,36 @@ class DbHandler:
                            .format(tn=_Db_constants.FILE_MAPPING_INFO,
                                    cn1=_Db_constants.LOCAL_PATH),
                            (local_path,))
-        self._execute_in_transaction(delete_function)
\ No newline at end of file
+        self._execute_in_transaction(delete_function)
+
+    def get_page_token(self, local_dir_path):
+        '''
+        Fetches the google drive changes page token saved for the synced local dir.
+        Args:
+            local_dir_path: 'A String'
+        Returns:
+            The page_token as String if record available else None
+        '''
+        def read_function(cursor):
+            cursor.execute('SELECT {cn1} FROM {tn} WHERE {cn2}=?'
+                           .format(tn=_Db_constants.SYNC_STATE,
+                                   cn1=_Db_constants.PAGE_TOKEN,
+                                   cn2=_Db_constants.LOCAL_PATH),
+                           (local_dir_path,))
+            final_val = cursor.fetchone()
+            if final_val:
+                return final_val[0]
+        return self._execute_read_function(read_function)
+
+    def set_page_token(self, local_dir_path, page_token):
+        '''
+        Saves the google drive changes page token for the synced local dir.
+        Args:
+            local_dir_path: 'A String'
+            page_token: 'A String'
+        '''
+        def insert_function(cursor):
+            cursor.execute('INSERT OR REPLACE INTO {tn} values(?, ?)'
+                           .format(tn=_Db_constants.SYNC_STATE),
+                           (local_dir_path, page_token))
+        self._execute_in_transaction(insert_function)
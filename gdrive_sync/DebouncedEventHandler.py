@@ -0,0 +1,129 @@
+from watchdog.events import FileSystemEventHandler, EVENT_TYPE_CREATED, EVENT_TYPE_DELETED, EVENT_TYPE_MODIFIED
+from concurrent import futures
+from gdrive_sync import utils
+import threading
+import time
+
+logger = utils.create_logger(__name__)
+
+
+class DebouncedEventHandler(FileSystemEventHandler):
+    """
+    Wraps a FileSystemEventHandler and holds the events of a path back until the path
+    has been quiet for a short while. A burst of events for a path, e.g. an editor
+    rewriting a file many times, is coalesced so that the file is synced once.
+
+    The events are dispatched in the order they arrived. The content uploads of the
+    modified events run in parallel, at most max_inflight at a time. When all the slots
+    are taken the flush waits, so the new events keep coalescing in the meantime.
+    """
+
+    def __init__(self, event_handler, delay, max_inflight):
+        '''
+        Args:
+            event_handler: The watchdog.events.FileSystemEventHandler which syncs the events
+            delay: Float, the seconds a path must be quiet before its events are dispatched
+            max_inflight: Integer, the max number of modified events synced at the same time
+        '''
+        FileSystemEventHandler.__init__(self)
+        self._event_handler = event_handler
+        self._delay = delay
+        # path vs (list of the coalesced events, the time after which they are dispatched)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        self._inflight = threading.BoundedSemaphore(max_inflight)
+        # the paths whose modified event is being synced
+        self._inflight_paths = set()
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_inflight)
+
+    def dispatch(self, event):
+        # the wrapped handler does nothing for modified dirs, and they would hold the
+        # events of the other paths back for as long as their children change
+        if event.is_directory and event.event_type == EVENT_TYPE_MODIFIED:
+            return
+        with self._lock:
+            events, _ = self._pending.get(event.src_path, ([], None))
+            self._coalesce(events, event)
+            if events:
+                self._pending[event.src_path] = (events, time.monotonic() + self._delay)
+            else:
+                self._pending.pop(event.src_path, None)
+            self._schedule_flush()
+
+    @staticmethod
+    def _coalesce(events, event):
+        '''
+        Adds the event to the pending events of its path, dropping the events made redundant by it.
+        Args:
+            events: A list of the pending events of the path, it is modified in place
+            event: A watchdog.events.FileSystemEvent object
+        '''
+        if event.event_type == EVENT_TYPE_MODIFIED:
+            if events and events[-1].event_type in (EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED):
+                # the latest content is synced by the earlier event
+                return
+        elif event.event_type == EVENT_TYPE_DELETED:
+            while events and events[-1].event_type == EVENT_TYPE_MODIFIED:
+                events.pop()
+            if events and events[-1].event_type == EVENT_TYPE_CREATED:
+                # the path was never synced
+                events.pop()
+                return
+        events.append(event)
+
+    def _schedule_flush(self):
+        '''
+        Starts the flush timer if there are pending events. It must be called with the lock held.
+        '''
+        if self._timer is None and self._pending:
+            self._timer = threading.Timer(self._delay, self._flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush(self):
+        '''
+        Dispatches the pending events whose paths have been quiet for the delay. It stops at
+        the first path which is not quiet yet, so that a created dir is synced before its children.
+        The paths which are still being synced are held back to the next flush.
+        '''
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            self._timer = None
+            for path, (events, deadline) in self._pending.items():
+                if deadline > now:
+                    break
+                if path not in self._inflight_paths:
+                    ready.append((path, events))
+            for path, _ in ready:
+                del self._pending[path]
+
+        for path, events in ready:
+            for event in events[:-1]:
+                self._dispatch_event(event)
+            if events[-1].event_type == EVENT_TYPE_MODIFIED:
+                # blocks while max_inflight modified events are being synced
+                self._inflight.acquire()
+                with self._lock:
+                    self._inflight_paths.add(path)
+                self._executor.submit(self._dispatch_inflight_event, path, events[-1])
+            else:
+                self._dispatch_event(events[-1])
+
+        with self._lock:
+            self._schedule_flush()
+
+    def _dispatch_inflight_event(self, path, event):
+        try:
+            self._dispatch_event(event)
+        finally:
+            with self._lock:
+                self._inflight_paths.discard(path)
+            self._inflight.release()
+
+    def _dispatch_event(self, event):
+        try:
+            self._event_handler.dispatch(event)
+        except Exception:
+            logger.error('Unable to sync the %s event of %s:', event.event_type, event.src_path, exc_info=True)
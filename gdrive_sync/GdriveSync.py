@@ -1,6 +1,10 @@
 from os import path
+from concurrent import futures
+import queue
+import itertools
 from watchdog import observers
-from gdrive_sync import utils, LocalFSEventHandler, Db
+from googleapiclient import errors
+from gdrive_sync import utils, LocalFSEventHandler, DebouncedEventHandler, Db, ApiBatch, configs
 import time
 import os
 
@@ -16,12 +20,25 @@ class GdriveSync:
     def __init__(self):
         self._local_dir_observer_dict = {}
         self._db_handler = Db.DbHandler()
+        # uploads and downloads are bound by network latency, hence they run in parallel
+        self._transfer_executor = futures.ThreadPoolExecutor(
+            max_workers=configs.get_configs().getint('SYNC', 'max_workers'))
+        # subdirs are independent of each other, hence they are synced in parallel from a work
+        # queue. A separate executor is used as the dir syncs wait for their transfers.
+        self._dir_workers_count = configs.get_configs().getint('SYNC', 'max_workers')
+        self._dir_executor = futures.ThreadPoolExecutor(max_workers=self._dir_workers_count)
+        self._dir_queue = queue.Queue()
+        self._dir_syncs_failed = False
 
     def _process_dir_pairs(self, service, dir_pairs):
         """
         Syncs the local and remote dirs with each other.
         Also saves the local_dir_paths and remote_dir_ids in the Db
 
+        Once a dir pair is synced, the google drive changes page token is saved for it. The next
+        sync only descends into the dirs which have changed at remote since then, or at local
+        compared to the Db. If there is no page token or it has expired, all the dirs are synced.
+
         Args:
             service: A googleapiclient.discovery.Resource object
             dir_pairs = A Dict of local dirs and remote dirs. It can be obtained by below:
@@ -35,24 +52,168 @@ class GdriveSync:
                                            remote_dir['id'],
                                            os.stat(local_dir).st_mtime,
                                            utils.convert_rfc3339_time_to_epoch(remote_dir['modifiedTime']))
-            remote_files_under_dir = utils.list_remote_files_from_dir(service,
-                                                                      remote_dir['id'])
             local_files_under_dir = utils.list_files_under_local_dir(local_dir)
-            self._compare_and_sync_files(service,
-                                         remote_files_under_dir,
-                                         remote_dir['id'],
-                                         local_files_under_dir,
-                                         local_dir)
+            page_token, changed_dirs = self._get_changed_dirs(service, local_dir, local_files_under_dir)
+
+            if changed_dirs is not None and os.path.normpath(local_dir) not in changed_dirs:
+                logger.debug('No changes in %s.', local_dir)
+            else:
+                remote_files_under_dir = utils.list_remote_files_from_dir(service,
+                                                                          remote_dir['id'])
+                self._submit_dir_sync(service,
+                                      remote_files_under_dir,
+                                      remote_dir['id'],
+                                      local_files_under_dir,
+                                      local_dir,
+                                      changed_dirs)
+                if not self._wait_for_dir_syncs():
+                    # The changes are synced again next time
+                    continue
+            self._db_handler.set_page_token(local_dir, page_token)
+
+    def _get_changed_dirs(self, service, local_dir, local_files):
+        """
+        Finds the dirs under local_dir which need to be synced using the google drive
+        changes since the last sync of local_dir.
+
+        Args:
+            service: A googleapiclient.discovery.Resource object
+            local_dir: 'A String' representing the path of the synced local dir
+            local_files: A dict of the files under local_dir as returned by utils.list_files_under_local_dir
+        Returns:
+            A tuple of the page token to be saved once local_dir is synced and a set of the
+            changed local dir paths. The set is None if all the dirs need to be synced.
+        """
+        page_token = self._db_handler.get_page_token(local_dir)
+        if page_token:
+            try:
+                changes, new_page_token = utils.list_changes(service, page_token)
+                return new_page_token, self._find_changed_dirs(local_dir, local_files, changes)
+            except errors.HttpError as e:
+                if e.resp.status != 410:
+                    raise
+                logger.info('Page token for %s has expired, syncing all the files.', local_dir)
+
+        # The page token is taken before the sync, so that the changes made
+        # in the meantime are picked up by the next sync
+        return utils.get_start_page_token(service), None
+
+    def _find_changed_dirs(self, local_dir, local_files, changes):
+        """
+        Finds the dirs under local_dir, including local_dir itself, which contain a changed file.
+        A dir is changed if it has a file which
+            - is changed at remote according to the google drive changes
+            - is not in Db, or is modified at local after the modification date saved in Db
+            - is in Db but does not exist at local anymore
+        The parent dirs of a changed dir are also changed, so that the sync can reach it.
+
+        Args:
+            local_dir: 'A String' representing the path of the synced local dir
+            local_files: A dict of the files under local_dir as returned by utils.list_files_under_local_dir
+            changes: A list of google drive changes as returned by utils.list_changes
+        Returns:
+            A set of the changed local dir paths
+        """
+        local_dir = os.path.normpath(local_dir)
+        changed_dirs = set()
+
+        def add_changed_dir(dir_path):
+            while dir_path not in changed_dirs and os.path.commonpath([local_dir, dir_path]) == local_dir:
+                changed_dirs.add(dir_path)
+                dir_path = os.path.dirname(dir_path)
+
+        # local changes
+        local_modification_dates_in_db = self._db_handler.get_local_modification_dates_under(local_dir)
+
+        def find_local_changes(files, dir_path):
+            for local_entry in files.values():
+                local_modification_date_in_db = local_modification_dates_in_db.pop(local_entry.path, None)
+                if local_entry.children is not None:
+                    if local_modification_date_in_db is None:
+                        add_changed_dir(dir_path)
+                    find_local_changes(local_entry.children, local_entry.path)
+                elif (local_modification_date_in_db is None or
+                        int(local_entry.mtime) > local_modification_date_in_db):
+                    add_changed_dir(dir_path)
+
+        find_local_changes(local_files, local_dir)
+        # the files left were removed from local
+        for local_path in local_modification_dates_in_db:
+            add_changed_dir(os.path.dirname(local_path))
+
+        # remote changes
+        remote_ids = set()
+        for change in changes:
+            remote_ids.add(change['fileId'])
+            remote_ids.update(change.get('file', {}).get('parents', []))
+        local_paths_in_db = self._db_handler.get_many_local_paths(remote_ids)
+        for change in changes:
+            if change['fileId'] in local_paths_in_db:
+                add_changed_dir(os.path.dirname(local_paths_in_db[change['fileId']]))
+            for parent_id in change.get('file', {}).get('parents', []):
+                if parent_id in local_paths_in_db:
+                    add_changed_dir(local_paths_in_db[parent_id])
+
+        return changed_dirs
+
+    def _submit_dir_sync(self, *args):
+        """
+        Adds a dir to the work queue of the dir syncs. The queued dirs are synced
+        by _wait_for_dir_syncs.
+
+        Args:
+            args: The arguments of _compare_and_sync_files
+        """
+        self._dir_queue.put(args)
+
+    def _wait_for_dir_syncs(self):
+        """
+        Syncs the queued dirs in parallel and waits until all of them, including the
+        subdirs queued in the meantime, are synced. A failed dir sync is logged and
+        does not stop the others. A dir sync fails if it raises or returns False.
+
+        Returns:
+            True if all the dir syncs succeeded else False
+        """
+        self._dir_syncs_failed = False
+        workers = [self._dir_executor.submit(self._sync_queued_dirs) for _ in range(self._dir_workers_count)]
+        # A dir sync queues its subdirs before it is marked as done,
+        # so the queue is joined only after the whole tree is synced.
+        self._dir_queue.join()
+        for _ in workers:
+            self._dir_queue.put(None)
+        futures.wait(workers)
+        return not self._dir_syncs_failed
+
+    def _sync_queued_dirs(self):
+        """
+        Worker loop of _wait_for_dir_syncs. Syncs the dirs from the work queue until it gets None.
+        """
+        while True:
+            args = self._dir_queue.get()
+            if args is None:
+                self._dir_queue.task_done()
+                return
+            try:
+                if self._compare_and_sync_files(*args) is False:
+                    self._dir_syncs_failed = True
+            except Exception:
+                logger.error('Unable to sync dir:', exc_info=True)
+                self._dir_syncs_failed = True
+            finally:
+                self._dir_queue.task_done()
 
     def _compare_and_sync_files(self,
                                 service,
                                 remote_files,
                                 remote_parent_dir_id,
                                 local_files,
-                                local_parent_dir):
+                                local_parent_dir,
+                                changed_dirs=None):
         """
         Compares the local and remote files by name and modification date
         and whichever is last modified replaces the other one with same name.
+        The subdirs are not descended into, but queued by _submit_dir_sync to be compared in parallel.
 
         It also saves the local_file_paths and remote_file_ids to Db.
 
@@ -60,7 +221,7 @@ class GdriveSync:
 
         Args:
             service: A googleapiclient.discovery.Resource object
-            remote_files: A generator of objects has the below format
+            remote_files: An iterable of objects has the below format
                 {
                 'id': 'A String' that represents the id of the remote file
                 'name': 'A String' that represents the name of the remote file
@@ -68,158 +229,280 @@ class GdriveSync:
                     of the remote file in rfc3339 format
                 }
             remote_parent_dir_id: 'A String' representing the parent dir id for the remote_files
-            local_files: A list of os.DirEntry
+            local_files: A dict of file name vs utils.LocalEntry as returned by
+                utils.list_files_under_local_dir
             local_parent_dir: 'A String' representing the parent dir for the local_files
+            changed_dirs: A set of the local dir paths to descend into, as returned by _find_changed_dirs.
+                The subdirs that exist at both local and remote and are not in it are skipped.
+                If None, all the subdirs are synced.
+        Returns:
+            True if all the transfers and remote changes succeeded else False
         """
-        local_file_dict = {}
-        for file in local_files:
-            if type(file) == dict:
-                key = next(iter(file))
-                local_file_dict[key.name] = file[key]
-            else:
-                local_file_dict[file.name] = file
-
-        for each_remote_entry in remote_files:
-
-            # If remote file is a dir
-            if each_remote_entry['mimeType'] == 'application/vnd.google-apps.folder':
-                tmp_local_files = []
-
-                # If remote dir is not created in local
-                if not each_remote_entry['name'] in local_file_dict:
-                    local_dir_path = path.join(local_parent_dir, each_remote_entry['name'])
-
-                    if self._db_handler.get_local_file_path(each_remote_entry['id']):
-                        logger.debug('Dir %s was removed from local.', local_dir_path)
-
-                        utils.delete_file_on_remote(each_remote_entry['id'])
-
-                        self._db_handler.delete_record(local_dir_path)
-
-                        continue
+        # The remote deletes and dir creations of this dir are sent in a single batch
+        batch = ApiBatch.ApiBatch(service)
+        transfers = []
+        # The Db records of this dir are saved together once the dir is synced
+        records = []
+        # The entries left in local_file_dict after the comparison do not exist at remote
+        local_file_dict = dict(local_files)
+        # The next page of remote files is fetched while the current page is compared
+        remote_files = utils.prefetch(remote_files, utils.REMOTE_PAGE_SIZE)
+
+        while True:
+            remote_page = list(itertools.islice(remote_files, utils.REMOTE_PAGE_SIZE))
+            if not remote_page:
+                break
+            local_paths_in_db = self._db_handler.get_many_local_paths(
+                [each_remote_entry['id'] for each_remote_entry in remote_page])
+
+            for each_remote_entry in remote_page:
+                remote_file_id = each_remote_entry['id']
+                remote_file_name = each_remote_entry['name']
+                remote_file_modified_time = utils.convert_rfc3339_time_to_epoch(each_remote_entry['modifiedTime'])
+                # only the binary files have a checksum
+                remote_md5_checksum = each_remote_entry.get('md5Checksum')
+
+                # If remote file is a dir
+                if each_remote_entry['mimeType'] == 'application/vnd.google-apps.folder':
+                    tmp_local_files = {}
+
+                    # If remote dir is not created in local
+                    if not remote_file_name in local_file_dict:
+                        local_dir_path = path.join(local_parent_dir, remote_file_name)
+
+                        if remote_file_id in local_paths_in_db:
+                            logger.debug('Dir %s was removed from local.', local_dir_path)
+
+                            batch.add(utils.build_delete_file_on_remote_request(service, remote_file_id),
+                                      self._get_delete_record_callback(local_dir_path))
+
+                            continue
+                        else:
+                            logger.debug('Creating dir %s in local.', local_dir_path)
+
+                            utils.create_local_dir(local_dir_path)
+
+                            records.append((local_dir_path,
+                                            remote_file_id,
+                                            int(time.time()),
+                                            remote_file_modified_time,
+                                            None))
+                        self._submit_dir_sync(service,
+                                              each_remote_entry['children'],
+                                              remote_file_id,
+                                              tmp_local_files,
+                                              local_dir_path)
                     else:
-                        logger.debug('Creating dir %s in local.', local_dir_path)
-
-                        utils.create_local_dir(local_dir_path)
-
-                        self._db_handler.insert_record(local_dir_path,
-                                                       each_remote_entry['id'],
-                                                       int(time.time()),
-                                                       utils.convert_rfc3339_time_to_epoch(
-                                                           each_remote_entry['modifiedTime']))
-                else:
-                    tmp_local_files = local_file_dict[each_remote_entry['name']]
-                    del local_file_dict[each_remote_entry['name']]
-
-                self._compare_and_sync_files(service,
-                                             each_remote_entry['children'],
-                                             each_remote_entry['id'],
-                                             tmp_local_files,
-                                             os.path.join(local_parent_dir, each_remote_entry['name']))
-
-            # If remote file exists in local
-            elif each_remote_entry['name'] in local_file_dict:
-                local_file = local_file_dict[each_remote_entry['name']]
-
-                remote_file_modified_time = utils.convert_rfc3339_time_to_epoch(
-                    each_remote_entry['modifiedTime'])
-
-                # If local file modification time is newer than remote file modification time
-                if local_file.stat().st_mtime > remote_file_modified_time:
-
-                    local_modification_date_in_db = self._db_handler.get_local_modification_date(local_file.path)
-                    actual_local_modification_date = int(local_file.stat().st_mtime)
-
-                    # If local file modification time is newer than saved in db else don't do anything
-                    # This cancels the cases where remote file was earlier copied to local
-                    if (not local_modification_date_in_db or
-                            actual_local_modification_date > local_modification_date_in_db):
-                        logger.debug('local_file.stat().st_mtime %s, local_modification_date_in_db %s.',
-                                     local_file.stat().st_mtime,
-                                     local_modification_date_in_db)
-                        logger.debug('Overwriting %s in remote.', local_file.path)
-
-                        utils.overwrite_remote_file_with_local(service,
-                                                               each_remote_entry['id'],
-                                                               local_file.path)
-
-                        self._db_handler.insert_record(local_file.path,
-                                                       each_remote_entry['id'],
-                                                       actual_local_modification_date,
-                                                       int(time.time()))
+                        tmp_local_files = local_file_dict.pop(remote_file_name).children
+                        local_dir_path = os.path.join(local_parent_dir, remote_file_name)
+
+                        if changed_dirs is None or local_dir_path in changed_dirs:
+                            self._submit_dir_sync(service,
+                                                  each_remote_entry['children'],
+                                                  remote_file_id,
+                                                  tmp_local_files,
+                                                  local_dir_path,
+                                                  changed_dirs)
+
+                # If remote file exists in local
+                elif remote_file_name in local_file_dict:
+                    local_file = local_file_dict.pop(remote_file_name)
+                    local_file_modified_time = local_file.mtime
+
+                    # If local file modification time is newer than remote file modification time
+                    if local_file_modified_time > remote_file_modified_time:
+
+                        local_modification_date_in_db = self._db_handler.get_local_modification_date(local_file.path)
+                        actual_local_modification_date = int(local_file_modified_time)
+
+                        # If local file modification time is newer than saved in db else don't do anything
+                        # This cancels the cases where remote file was earlier copied to local
+                        if (not local_modification_date_in_db or
+                                actual_local_modification_date > local_modification_date_in_db):
+                            logger.debug('local_file_modified_time %s, local_modification_date_in_db %s.',
+                                         local_file_modified_time,
+                                         local_modification_date_in_db)
+                            logger.debug('Overwriting %s in remote.', local_file.path)
+
+                            self._submit_transfer(transfers,
+                                                  self._transfer_if_content_differs,
+                                                  (utils.overwrite_remote_file_with_local,
+                                                   (service, remote_file_id, local_file.path),
+                                                   local_file.path,
+                                                   remote_md5_checksum),
+                                                  local_file.path,
+                                                  remote_id=remote_file_id,
+                                                  local_modification_date=actual_local_modification_date)
+
+                    # If remote file modification time is newer than local file modification time
+                    elif remote_file_modified_time > local_file_modified_time:
+
+                        remote_file_modification_time_in_db = self._db_handler.get_remote_modification_date(
+                            remote_file_id)
+
+                        # If remote file modification time is newer than saved in db
+                        # This cancels the cases where local file was earlier copied to remote
+                        if (not remote_file_modification_time_in_db or
+                                remote_file_modified_time > remote_file_modification_time_in_db):
+                            logger.debug('remote_file_modified_time %s, remote_file_modification_time_in_db %s.',
+                                         remote_file_modified_time,
+                                         remote_file_modification_time_in_db)
+                            logger.debug('Overwriting %s in local.', local_file.path)
+
+                            self._submit_transfer(transfers,
+                                                  self._transfer_if_content_differs,
+                                                  (utils.copy_remote_file_to_local,
+                                                   (service, local_file.path, remote_file_id),
+                                                   local_file.path,
+                                                   remote_md5_checksum),
+                                                  local_file.path,
+                                                  remote_id=remote_file_id,
+                                                  remote_modification_date=remote_file_modified_time,
+                                                  content_hash=remote_md5_checksum)
+
+                else:  # remote file does not exist in local
+
+                    local_file_path = path.join(local_parent_dir, remote_file_name)
+
+                    if remote_file_id in local_paths_in_db:
+                        logger.debug('File %s was removed from local.', local_file_path)
+
+                        batch.add(utils.build_delete_file_on_remote_request(service, remote_file_id),
+                                  self._get_delete_record_callback(local_file_path))
 
-                # If remote file modification time is newer than local file modification time
-                elif remote_file_modified_time > local_file.stat().st_mtime:
-
-                    remote_file_modification_time_in_db = self._db_handler.get_remote_modification_date(
-                        each_remote_entry['id'])
-
-                    # If remote file modification time is newer than saved in db
-                    # This cancels the cases where local file was earlier copied to remote
-                    if (not remote_file_modification_time_in_db or
-                            remote_file_modified_time > remote_file_modification_time_in_db):
-                        logger.debug('remote_file_modified_time %s, remote_file_modification_time_in_db %s.',
-                                     remote_file_modified_time,
-                                     remote_file_modification_time_in_db)
-                        logger.debug('Overwriting %s in local.', local_file.path)
+                    else:
+                        logger.debug('Creating %s in local.', local_file_path)
 
-                        utils.copy_remote_file_to_local(service,
-                                                        local_file.path,
-                                                        each_remote_entry['id'])
+                        self._submit_transfer(transfers,
+                                              utils.copy_remote_file_to_local,
+                                              (service, local_file_path, remote_file_id),
+                                              local_file_path,
+                                              remote_id=remote_file_id,
+                                              remote_modification_date=remote_file_modified_time,
+                                              content_hash=remote_md5_checksum)
 
-                        self._db_handler.insert_record(local_file.path,
-                                                       each_remote_entry['id'],
-                                                       int(time.time()),
-                                                       remote_file_modified_time)
-                del local_file_dict[each_remote_entry['name']]
+        # copy the local files that do not exist at remote
+        self._copy_local_to_remote(local_file_dict, remote_parent_dir_id, service, batch, transfers, records)
+        batch.execute()
+        transfer_records = self._wait_for_transfers(transfers)
+        records.extend(transfer_records)
+        self._db_handler.insert_many(records)
+        return not batch.failure_count and len(transfer_records) == len(transfers)
+
+    def _submit_transfer(self,
+                         transfers,
+                         function,
+                         args,
+                         local_path,
+                         remote_id=None,
+                         local_modification_date=None,
+                         remote_modification_date=None,
+                         content_hash=None):
+        """
+        Submits a media upload/download to the transfer executor. The record of the
+        transfer is returned by _wait_for_transfers once the transfer succeeds.
 
-            else:  # remote file does not exist in local
+        Args:
+            transfers: A list which collects the submitted transfers of a dir
+            function: The utils function doing the upload/download
+            args: A tuple of the arguments for function
+            local_path: 'A String'
+            remote_id: 'A String'. If None, the return value of function is used.
+            local_modification_date: Integer. If None, the time of completion is used.
+            remote_modification_date: Integer. If None, the time of completion is used.
+            content_hash: 'A String' md5 checksum of the content after the transfer, None if unknown
+        """
+        transfers.append((self._transfer_executor.submit(function, *args),
+                          (local_path, remote_id, local_modification_date, remote_modification_date, content_hash)))
 
-                local_file_path = path.join(local_parent_dir, each_remote_entry['name'])
+    def _transfer_if_content_differs(self, function, args, local_path, remote_md5_checksum):
+        """
+        Runs the upload/download only if the content of the local file differs from the remote file.
+        Files with different modification times but the same content, e.g. because of a clock
+        skew or a touch, are not transferred again.
 
-                if self._db_handler.get_local_file_path(each_remote_entry['id']):
-                    logger.debug('File %s was removed from local.', local_file_path)
+        Args:
+            function: The utils function doing the upload/download
+            args: A tuple of the arguments for function
+            local_path: 'A String'
+            remote_md5_checksum: 'A String' md5Checksum of the remote file, None if google drive has none
+        Returns:
+            The return value of function, None if the transfer is skipped
+        """
+        if remote_md5_checksum and utils.get_md5_checksum(local_path) == remote_md5_checksum:
+            logger.debug('Content of %s is unchanged, skipping the transfer.', local_path)
+            return None
+        return function(*args)
 
-                    utils.delete_file_on_remote(each_remote_entry['id'])
+    def _wait_for_transfers(self, transfers):
+        """
+        Waits for the submitted transfers and collects the Db records of the successful ones.
+        A failed transfer is logged and does not affect the others.
 
-                    self._db_handler.delete_record(local_file_path)
+        Args:
+            transfers: A list of transfers filled by _submit_transfer
+        Returns:
+            A list of (local_path, remote_id, local_modification_date, remote_modification_date, content_hash)
+        """
+        futures.wait([future for future, _ in transfers])
+        records = []
+        for future, (local_path,
+                     remote_id,
+                     local_modification_date,
+                     remote_modification_date,
+                     content_hash) in transfers:
+            if future.exception() is not None:
+                logger.error('Unable to transfer %s:', local_path, exc_info=future.exception())
+                continue
+            time_now = int(time.time())
+            records.append((local_path,
+                            remote_id if remote_id else future.result(),
+                            time_now if local_modification_date is None else local_modification_date,
+                            time_now if remote_modification_date is None else remote_modification_date,
+                            content_hash))
+        return records
+
+    def _get_delete_record_callback(self, local_path):
+        """
+        Returns an ApiBatch callback which removes the local_path from Db once
+        the batched remote delete succeeds.
+        """
+        return lambda response: self._db_handler.delete_record(local_path)
 
-                else:
-                    logger.debug('Creating %s in local.', local_file_path)
+    def _copy_local_to_remote(self, local_file_dict, remote_parent_dir_id, service, batch, transfers, records):
+        """
+        Copies the local files and dirs to remote. The dirs of this level are created
+        in a single batch before their children are copied.
 
-                    utils.copy_remote_file_to_local(service,
-                                                    local_file_path,
-                                                    each_remote_entry['id'])
-                    self._db_handler.insert_record(local_file_path,
-                                                   each_remote_entry['id'],
-                                                   int(time.time()),
-                                                   utils.convert_rfc3339_time_to_epoch(
-                                                       each_remote_entry['modifiedTime']))
+        Args:
+            local_file_dict: A dict of file name vs utils.LocalEntry as returned by
+                utils.list_files_under_local_dir
+            remote_parent_dir_id: 'A String' representing the remote parent dir id
+            service: A googleapiclient.discovery.Resource object
+            batch: An ApiBatch.ApiBatch object
+            transfers: A list which collects the submitted uploads, see _submit_transfer
+            records: A list which collects the Db records of the created dirs
+        """
+        created_dirs = []
 
-        # copy the local files that do not exist at remote
-        self._copy_local_to_remote(local_file_dict, remote_parent_dir_id, service)
+        def get_create_dir_callback(local_dir):
+            def callback(response):
+                created_dirs.append((local_dir, response['id']))
+            return callback
 
-    def _copy_local_to_remote(self, local_file_dict, remote_parent_dir_id, service):
         for file_name, local_file in local_file_dict.items():
 
-            if type(local_file) == dict:
-                dir_key = next(iter(local_file))
+            if local_file.children is not None:
 
-                if self._db_handler.get_remote_file_id(dir_key.path):
-                    logger.debug('Remote dir %s was deleted.', dir_key.path)
-                    utils.delete_file_from_local(dir_key.path)
-                    self._db_handler.delete_record(dir_key.path)
+                if self._db_handler.get_remote_file_id(local_file.path):
+                    logger.debug('Remote dir %s was deleted.', local_file.path)
+                    utils.delete_file_from_local(local_file.path)
+                    self._db_handler.delete_record(local_file.path)
 
                 else:
-                    logger.debug('Creating dir %s at remote.', dir_key.path)
-                    remote_dir_id = utils.create_remote_dir(file_name, remote_parent_dir_id)
-                    self._db_handler.insert_record(dir_key.path,
-                                                   remote_dir_id,
-                                                   dir_key.stat().st_mtime,
-                                                   int(time.time()))
-                    self._copy_local_to_remote({file.name: file for file in local_file[dir_key]},
-                                               remote_dir_id,
-                                               service)
+                    logger.debug('Creating dir %s at remote.', local_file.path)
+                    batch.add(utils.build_create_remote_dir_request(service, file_name, remote_parent_dir_id),
+                              get_create_dir_callback(local_file))
             else:
                 if self._db_handler.get_remote_file_id(local_file.path):
                     logger.debug('Remote dir %s was deleted.', local_file.path)
@@ -229,13 +512,26 @@ class GdriveSync:
                 else:
                     logger.debug('Creating file %s at remote.', local_file.path)
 
-                    remote_file_id = utils.copy_local_file_to_remote(local_file.path,
-                                                                     remote_parent_dir_id,
-                                                                     service)
-                    self._db_handler.insert_record(local_file.path,
-                                                   remote_file_id,
-                                                   local_file.stat().st_mtime,
-                                                   int(time.time()))
+                    self._submit_transfer(transfers,
+                                          utils.copy_local_file_to_remote,
+                                          (local_file.path, remote_parent_dir_id, service),
+                                          local_file.path,
+                                          local_modification_date=local_file.mtime)
+
+        # the dirs must exist at remote before their children can be copied
+        batch.execute()
+        for local_dir, remote_dir_id in created_dirs:
+            records.append((local_dir.path,
+                            remote_dir_id,
+                            local_dir.mtime,
+                            int(time.time()),
+                            None))
+            self._copy_local_to_remote(local_dir.children,
+                                       remote_dir_id,
+                                       service,
+                                       batch,
+                                       transfers,
+                                       records)
 
     def sync_onetime(self, synced_dirs_dict):
         """
@@ -258,7 +554,11 @@ class GdriveSync:
         Returns:
             An object of watchdog.observers.Observer.
         """
-        event_handler = LocalFSEventHandler.LocalFSEventHandler(self._db_handler)
+        # bursts of events are coalesced before they are synced
+        event_handler = DebouncedEventHandler.DebouncedEventHandler(
+            LocalFSEventHandler.LocalFSEventHandler(self._db_handler),
+            configs.get_configs().getfloat('SYNC', 'event_debounce_delay'),
+            configs.get_configs().getint('SYNC', 'max_inflight_events'))
         observer = observers.Observer()
         observer.schedule(event_handler, dir_to_watch, recursive=True)
         observer.start()
@@ -0,0 +1,58 @@
+from unittest import TestCase
+from unittest.mock import Mock, call
+
+from gdrive_sync import ApiBatch
+
+
+class TestApiBatch(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.mocked_service = Mock()
+        self.mocked_batch_request = self.mocked_service.new_batch_http_request.return_value
+        self.apiBatch = ApiBatch.ApiBatch(self.mocked_service)
+
+    def test_add(self):
+        self.apiBatch.add('request1')
+        self.apiBatch.add('request2', Mock())
+
+        self.assertEqual(2, len(self.apiBatch))
+        self.mocked_service.new_batch_http_request.assert_not_called()
+
+    def test_execute(self):
+        callback_1 = Mock()
+        callback_2 = Mock()
+        self.apiBatch.add('request1', callback_1)
+        self.apiBatch.add('request2', callback_2)
+        self.apiBatch.add('request3')
+
+        def execute_batch():
+            on_response = self.mocked_service.new_batch_http_request.call_args[1]['callback']
+            on_response('0', {'id': 'id1'}, None)
+            on_response('1', None, Exception('failed'))
+            on_response('2', {'id': 'id3'}, None)
+        self.mocked_batch_request.execute.side_effect = execute_batch
+
+        self.assertEqual({'0': {'id': 'id1'}, '2': {'id': 'id3'}}, self.apiBatch.execute())
+
+        self.mocked_batch_request.add.assert_has_calls([call('request1', request_id='0'),
+                                                        call('request2', request_id='1'),
+                                                        call('request3', request_id='2')])
+        self.mocked_batch_request.execute.assert_called_once_with()
+        callback_1.assert_called_once_with({'id': 'id1'})
+        callback_2.assert_not_called()
+        self.assertEqual(0, len(self.apiBatch))
+        self.assertEqual(1, self.apiBatch.failure_count)
+
+    def test_execute_empty(self):
+        self.assertEqual({}, self.apiBatch.execute())
+
+        self.mocked_service.new_batch_http_request.assert_not_called()
+
+    def test_add_full_batch(self):
+        for i in range(ApiBatch.MAX_BATCH_SIZE + 1):
+            self.apiBatch.add('request{}'.format(i))
+
+        self.mocked_batch_request.execute.assert_called_once_with()
+        self.assertEqual(ApiBatch.MAX_BATCH_SIZE, self.mocked_batch_request.add.call_count)
+        self.assertEqual(1, len(self.apiBatch))
@@ -21,22 +21,56 @@ class TestDbHandler(TestCase):
     
     def test_init(self):
         self.assertTrue(os.path.exists(self._test_db_path), msg='Db file not created')
+
+        def fetch_journal_mode(cursor):
+            cursor.execute('PRAGMA journal_mode')
+            return cursor.fetchone()[0]
+        self.assertEqual('wal', self._execute_db_function(fetch_journal_mode))
         
+    def test_init_adds_content_hash_column(self):
+        def create_old_table(cursor):
+            cursor.execute('DROP TABLE file_mapping_info')
+            cursor.execute('CREATE TABLE file_mapping_info (local_path TEXT, remote_id TEXT, '
+                           'local_modification_date INTEGER, remote_modification_date INTEGER)')
+            cursor.execute('insert into file_mapping_info values(?, ?, ?, ?)', ('local_path', 'remote_id', 101, 1001))
+        self._execute_db_function(create_old_table)
+
+        self._db_handler = Db.DbHandler(self._test_db_path)
+
+        def fetch_records(cursor):
+            cursor.execute('select * from file_mapping_info')
+            return cursor.fetchall()
+        self.assertEqual([('local_path', 'remote_id', 101, 1001, None)], self._execute_db_function(fetch_records))
+
     def test_get_remote_file_id(self):
         def insert_records(cursor):
-            cursor.execute('insert into {} values(?, ?, ?, ?)'.format('file_mapping_info'),
+            cursor.execute('insert into {} values(?, ?, ?, ?, NULL)'.format('file_mapping_info'),
                            ('local_path', 'remote_id', 101, 1001))
         self._execute_db_function(insert_records)
         self.assertEqual('remote_id', self._db_handler.get_remote_file_id('local_path'))
     
     def test_get_local_file_path(self):
         def insert_records(cursor):
-            cursor.execute('insert into {} values(?, ?, ?, ?)'.format('file_mapping_info'),
+            cursor.execute('insert into {} values(?, ?, ?, ?, NULL)'.format('file_mapping_info'),
                            ('local_path', 'remote_id', 101, 1001))
         self._execute_db_function(insert_records)
         self.assertEqual('local_path', self._db_handler.get_local_file_path('remote_id'))
         
     
+    def test_get_many_local_paths(self):
+        def insert_records(cursor):
+            cursor.executemany('insert into {} values(?, ?, ?, ?, NULL)'.format('file_mapping_info'),
+                               [('local_path{}'.format(i), 'remote_id{}'.format(i), 101, 1001) for i in range(1000)])
+        self._execute_db_function(insert_records)
+        remote_ids = ['remote_id{}'.format(i) for i in range(1000)] + ['remote_id_unknown']
+
+        local_paths = self._db_handler.get_many_local_paths(remote_ids)
+
+        self.assertEqual(1000, len(local_paths))
+        self.assertEqual('local_path0', local_paths['remote_id0'])
+        self.assertEqual('local_path999', local_paths['remote_id999'])
+        self.assertEqual({}, self._db_handler.get_many_local_paths([]))
+
     def _execute_db_function(self, function):
         try:
             connection = sqlite3.connect(self._test_db_path)
@@ -76,24 +110,48 @@ class TestDbHandler(TestCase):
         self.assertEqual('remote_id_modified', records[0][1])
         self.assertEqual(10003, records[0][2])
         self.assertEqual(103, records[0][3])
+        self.assertIsNone(records[0][4])
+
+
+        self._db_handler.insert_record('local_path',
+                                       'remote_id_modified',
+                                       10004,
+                                       104,
+                                       'content_hash')
+        records = self._execute_db_function(fetch_inserted_records)
+        self.assertEqual(1, len(records))
+        self.assertEqual('content_hash', records[0][4])
+
+    def test_insert_many(self):
+        def fetch_inserted_records(cursor):
+            cursor.execute('select * from {} order by {}'.format('file_mapping_info', 'local_path'))
+            return cursor.fetchall()
+        self._db_handler.insert_record('local_path1', 'remote_id1', 10001, 101)
+
+        self._db_handler.insert_many([('local_path1', 'remote_id1_modified', 10002, 102, 'hash1'),
+                                      ('local_path2', 'remote_id2', 10003, 103, None)])
+
+        self.assertEqual([('local_path1', 'remote_id1_modified', 10002, 102, 'hash1'),
+                          ('local_path2', 'remote_id2', 10003, 103, None)],
+                         self._execute_db_function(fetch_inserted_records))
 
     def test_get_local_modification_date(self):
         def insert_records(cursor):
-            cursor.execute('insert into {} values(?, ?, ?, ?)'.format('file_mapping_info'),
+            cursor.execute('insert into {} values(?, ?, ?, ?, NULL)'.format('file_mapping_info'),
                            ('local_path', 'remote_id', 101, 1001))
         self._execute_db_function(insert_records)
         self.assertEqual(101, self._db_handler.get_local_modification_date('local_path'))
         
     def test_get_remote_modification_date(self):
         def insert_records(cursor):
-            cursor.execute('insert into {} values(?, ?, ?, ?)'.format('file_mapping_info'),
+            cursor.execute('insert into {} values(?, ?, ?, ?, NULL)'.format('file_mapping_info'),
                            ('local_path', 'remote_id', 101, 1001))
         self._execute_db_function(insert_records)
         self.assertEqual(1001, self._db_handler.get_remote_modification_date('remote_id'))
     
     def test_update_record(self):
         def insert_records(cursor):
-            cursor.execute('insert into {} values(?, ?, ?, ?)'.format('file_mapping_info'),
+            cursor.execute('insert into {} values(?, ?, ?, ?, NULL)'.format('file_mapping_info'),
                            ('local_path', 'remote_id', 101, 1001))
         self._execute_db_function(insert_records)
         self._db_handler.update_record('local_path', 'remote_id_modified', 102, 1002)
@@ -111,7 +169,7 @@ class TestDbHandler(TestCase):
     
     def test_delete_record(self):
         def insert_records(cursor):
-            cursor.execute('insert into {} values(?, ?, ?, ?)'.format('file_mapping_info'),
+            cursor.execute('insert into {} values(?, ?, ?, ?, NULL)'.format('file_mapping_info'),
                            ('local_path', 'remote_id', 101, 1001))
         self._execute_db_function(insert_records)
         
@@ -123,4 +181,28 @@ class TestDbHandler(TestCase):
                            ('local_path',))
             return cursor.fetchall()
         records = self._execute_db_function(fetch_records)
-        self.assertEqual(0, len(records))
\ No newline at end of file
+        self.assertEqual(0, len(records))
+
+    def test_get_local_modification_dates_under(self):
+        def insert_records(cursor):
+            cursor.executemany('insert into {} values(?, ?, ?, ?, NULL)'.format('file_mapping_info'),
+                               [('/dir', 'remote_id1', 101, 1001),
+                                ('/dir/file', 'remote_id2', 102, 1002),
+                                ('/dir/child/file', 'remote_id3', 103, 1003),
+                                ('/dir2/file', 'remote_id4', 104, 1004)])
+        self._execute_db_function(insert_records)
+
+        self.assertEqual({'/dir/file': 102, '/dir/child/file': 103},
+                         self._db_handler.get_local_modification_dates_under('/dir'))
+        self.assertEqual({'/dir/file': 102, '/dir/child/file': 103},
+                         self._db_handler.get_local_modification_dates_under('/dir/'))
+
+    def test_page_token(self):
+        self.assertIsNone(self._db_handler.get_page_token('/dir'))
+
+        self._db_handler.set_page_token('/dir', 'token1')
+        self._db_handler.set_page_token('/dir', 'token2')
+        self._db_handler.set_page_token('/dir2', 'token3')
+
+        self.assertEqual('token2', self._db_handler.get_page_token('/dir'))
+        self.assertEqual('token3', self._db_handler.get_page_token('/dir2'))
@@ -0,0 +1,116 @@
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import Mock, patch, call
+
+from watchdog.events import FileCreatedEvent, FileModifiedEvent, FileDeletedEvent, DirModifiedEvent, \
+    DirCreatedEvent
+
+from gdrive_sync.DebouncedEventHandler import DebouncedEventHandler
+
+
+@patch('time.monotonic', autospec=True)
+class TestDebouncedEventHandler(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.mock_event_handler = Mock()
+        self.debouncedEventHandler = DebouncedEventHandler(self.mock_event_handler, 0.5, 2)
+        # the flushes are invoked by the tests
+        self.debouncedEventHandler._schedule_flush = Mock()
+
+    def _dispatch(self, mock_monotonic, now, event):
+        mock_monotonic.return_value = now
+        self.debouncedEventHandler.dispatch(event)
+
+    def _flush(self, mock_monotonic, now):
+        mock_monotonic.return_value = now
+        self.debouncedEventHandler._flush()
+        self.debouncedEventHandler._executor.shutdown(wait=True)
+
+    def test_coalesce(self, mock_monotonic):
+        created = FileCreatedEvent('created')
+        modified = FileModifiedEvent('modified')
+        deleted = FileDeletedEvent('deleted')
+        self._dispatch(mock_monotonic, 0, created)
+        self._dispatch(mock_monotonic, 0, FileModifiedEvent('created'))
+        self._dispatch(mock_monotonic, 0, modified)
+        self._dispatch(mock_monotonic, 0, FileModifiedEvent('modified'))
+        self._dispatch(mock_monotonic, 0, FileModifiedEvent('deleted'))
+        self._dispatch(mock_monotonic, 0, deleted)
+        self._dispatch(mock_monotonic, 0, FileCreatedEvent('temporary'))
+        self._dispatch(mock_monotonic, 0, FileModifiedEvent('temporary'))
+        self._dispatch(mock_monotonic, 0, FileDeletedEvent('temporary'))
+        self._dispatch(mock_monotonic, 0, DirModifiedEvent('dir'))
+
+        self._flush(mock_monotonic, 1)
+
+        self.mock_event_handler.dispatch.assert_has_calls([call(created), call(modified), call(deleted)],
+                                                          any_order=True)
+        self.assertEqual(3, self.mock_event_handler.dispatch.call_count)
+        self.assertEqual({}, self.debouncedEventHandler._pending)
+
+    def test_flush_waits_for_quiet_paths(self, mock_monotonic):
+        created_dir = DirCreatedEvent('dir')
+        created_file = FileCreatedEvent('dir/file')
+        modified_file = FileModifiedEvent('file')
+        self._dispatch(mock_monotonic, 0, created_dir)
+        self._dispatch(mock_monotonic, 0.4, created_file)
+        self._dispatch(mock_monotonic, 0.4, modified_file)
+
+        self._flush(mock_monotonic, 0.6)
+
+        self.mock_event_handler.dispatch.assert_called_once_with(created_dir)
+        self.assertEqual(['dir/file', 'file'], list(self.debouncedEventHandler._pending))
+
+        self.debouncedEventHandler._executor = DebouncedEventHandler(Mock(), 0.5, 2)._executor
+        self._flush(mock_monotonic, 1)
+
+        self.mock_event_handler.dispatch.assert_has_calls([call(created_dir), call(created_file), call(modified_file)])
+        self.assertEqual({}, self.debouncedEventHandler._pending)
+
+    def test_flush_holds_inflight_paths_back(self, mock_monotonic):
+        syncing = threading.Event()
+        release = threading.Event()
+
+        def dispatch(event):
+            syncing.set()
+            release.wait()
+        self.mock_event_handler.dispatch.side_effect = dispatch
+        self._dispatch(mock_monotonic, 0, FileModifiedEvent('file'))
+        mock_monotonic.return_value = 1
+        self.debouncedEventHandler._flush()
+        syncing.wait()
+
+        modified_again = FileModifiedEvent('file')
+        self._dispatch(mock_monotonic, 1, modified_again)
+        self._dispatch(mock_monotonic, 1, FileCreatedEvent('other_file'))
+        mock_monotonic.return_value = 2
+        self.debouncedEventHandler._flush()
+
+        self.assertEqual(['file'], list(self.debouncedEventHandler._pending))
+        self.assertEqual(2, self.mock_event_handler.dispatch.call_count)
+        release.set()
+        self.debouncedEventHandler._executor.shutdown(wait=True)
+        self.assertEqual(set(), self.debouncedEventHandler._inflight_paths)
+
+    def test_dispatch_error(self, mock_monotonic):
+        self.mock_event_handler.dispatch.side_effect = [Exception('Sync failed'), None]
+        created = FileCreatedEvent('file2')
+        self._dispatch(mock_monotonic, 0, FileCreatedEvent('file1'))
+        self._dispatch(mock_monotonic, 0, created)
+
+        self._flush(mock_monotonic, 1)
+
+        self.mock_event_handler.dispatch.assert_called_with(created)
+        self.assertEqual(2, self.mock_event_handler.dispatch.call_count)
+
+    def test_schedule_flush(self, mock_monotonic):
+        mock_monotonic.side_effect = time.monotonic
+        flushed = threading.Event()
+        self.mock_event_handler.dispatch.side_effect = lambda event: flushed.set()
+        debouncedEventHandler = DebouncedEventHandler(self.mock_event_handler, 0.05, 2)
+
+        debouncedEventHandler.dispatch(FileCreatedEvent('file'))
+
+        self.assertTrue(flushed.wait(timeout=5))
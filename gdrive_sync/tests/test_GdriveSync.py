@@ -1,10 +1,11 @@
 from unittest import TestCase
-from unittest.mock import Mock, patch, call
+from unittest.mock import Mock, patch, call, ANY
 from unittest.case import skip
 import time
 
 from gdrive_sync.GdriveSync import GdriveSync
-from gdrive_sync import utils, Db
+from googleapiclient import errors
+from gdrive_sync import utils, Db, ApiBatch
 
 logger = utils.create_logger(__name__)
 
@@ -23,6 +24,7 @@ class TestGdriveSync(TestCase):
     def test_process_dir_pairs_manual(self):
         self.gdriveSync._process_dir_pairs(utils.get_service(), {'/tmp/gdrive-sync/': '/test folder'})
 
+    @patch('gdrive_sync.utils.get_start_page_token', autospec=True)
     @patch('os.stat', autospec=True)
     @patch('gdrive_sync.utils.convert_rfc3339_time_to_epoch', autospec=True)
     @patch('gdrive_sync.utils.list_files_under_local_dir', autospec=True)
@@ -33,8 +35,10 @@ class TestGdriveSync(TestCase):
                                mock_list_remote_files_from_dir,
                                mock_list_files_under_local_dir,
                                mock_convert_rfc3339_time_to_epoch,
-                               mock_os_stat):
+                               mock_os_stat,
+                               mock_get_start_page_token):
         mocked_service = Mock()
+        mock_get_start_page_token.return_value = 'page_token'
         dir_pairs = {'/home/test1/child': '/test1/child'}
         mock_get_remote_dir.return_value = {'id': 'remote_dir_id', 'modifiedTime': 'test_modifiedTime'}
         mock_list_remote_files_from_dir.return_value = 'remote_files_under_dir'
@@ -42,6 +46,7 @@ class TestGdriveSync(TestCase):
         self.gdriveSync._compare_and_sync_files = Mock()
         mock_convert_rfc3339_time_to_epoch.return_value = 101
         self.gdriveSync._db_handler = Mock(Db.DbHandler)
+        self.gdriveSync._db_handler.get_page_token.return_value = None
         mock_os_stat.return_value.st_mtime = 1001
 
         self.gdriveSync._process_dir_pairs(mocked_service, dir_pairs)
@@ -53,14 +58,132 @@ class TestGdriveSync(TestCase):
                                                                         'remote_files_under_dir',
                                                                         'remote_dir_id',
                                                                         'local_files_under_dir',
-                                                                        '/home/test1/child')
+                                                                        '/home/test1/child',
+                                                                        None)
         mock_convert_rfc3339_time_to_epoch.assert_called_once_with('test_modifiedTime')
         self.gdriveSync._db_handler.insert_record.assert_called_once_with('/home/test1/child',
                                                                           'remote_dir_id',
                                                                           1001,
                                                                           101)
+        self.gdriveSync._db_handler.get_page_token.assert_called_once_with('/home/test1/child')
+        mock_get_start_page_token.assert_called_once_with(mocked_service)
+        self.gdriveSync._db_handler.set_page_token.assert_called_once_with('/home/test1/child', 'page_token')
 
-    @patch('gdrive_sync.utils.delete_file_on_remote', autospec=True)
+    @patch('gdrive_sync.utils.list_changes', autospec=True)
+    @patch('os.stat', autospec=True)
+    @patch('gdrive_sync.utils.list_files_under_local_dir', autospec=True)
+    @patch('gdrive_sync.utils.list_remote_files_from_dir', autospec=True)
+    @patch('gdrive_sync.utils.get_remote_dir', autospec=True)
+    def test_process_dir_pairs_with_page_token(self,
+                                               mock_get_remote_dir,
+                                               mock_list_remote_files_from_dir,
+                                               mock_list_files_under_local_dir,
+                                               mock_os_stat,
+                                               mock_list_changes):
+        mocked_service = Mock()
+        dir_pairs = {'/home/test1/child': '/test1/child',
+                     '/home/test2/': '/test2',
+                     '/home/test3': '/test3'}
+        mock_get_remote_dir.return_value = {'id': 'remote_dir_id', 'modifiedTime': '2017-06-28T03:25:20.954Z'}
+        mock_list_remote_files_from_dir.return_value = 'remote_files_under_dir'
+        mock_list_files_under_local_dir.return_value = 'local_files_under_dir'
+        mock_os_stat.return_value.st_mtime = 1001
+        mock_list_changes.return_value = ('changes', 'new_page_token')
+        self.gdriveSync._db_handler = Mock(Db.DbHandler)
+        self.gdriveSync._db_handler.get_page_token.return_value = 'page_token'
+        self.gdriveSync._find_changed_dirs = Mock(side_effect=[{'/home/test1'},
+                                                               {'/home/test2', '/home/test2/dir'},
+                                                               {'/home/test3'}])
+        self.gdriveSync._compare_and_sync_files = Mock(side_effect=[True, False])
+
+        self.gdriveSync._process_dir_pairs(mocked_service, dir_pairs)
+
+        mock_list_changes.assert_has_calls([call(mocked_service, 'page_token')] * 3)
+        self.gdriveSync._find_changed_dirs.assert_has_calls([call('/home/test1/child', 'local_files_under_dir', 'changes'),
+                                                             call('/home/test2/', 'local_files_under_dir', 'changes'),
+                                                             call('/home/test3', 'local_files_under_dir', 'changes')])
+        self.gdriveSync._compare_and_sync_files.assert_has_calls([call(mocked_service,
+                                                                       'remote_files_under_dir',
+                                                                       'remote_dir_id',
+                                                                       'local_files_under_dir',
+                                                                       '/home/test2/',
+                                                                       {'/home/test2', '/home/test2/dir'}),
+                                                                  call(mocked_service,
+                                                                       'remote_files_under_dir',
+                                                                       'remote_dir_id',
+                                                                       'local_files_under_dir',
+                                                                       '/home/test3',
+                                                                       {'/home/test3'})])
+        # The unchanged dir is skipped and the failed one is synced again next time
+        self.gdriveSync._db_handler.set_page_token.assert_has_calls([call('/home/test1/child', 'new_page_token'),
+                                                                     call('/home/test2/', 'new_page_token')])
+        self.assertEqual(2, self.gdriveSync._db_handler.set_page_token.call_count)
+
+    @patch('gdrive_sync.utils.get_start_page_token', autospec=True)
+    @patch('gdrive_sync.utils.list_changes', autospec=True)
+    def test_get_changed_dirs_expired_page_token(self, mock_list_changes, mock_get_start_page_token):
+        response = Mock()
+        response.status = 410
+        mock_list_changes.side_effect = errors.HttpError(response, b'')
+        mock_get_start_page_token.return_value = 'new_page_token'
+        self.gdriveSync._db_handler = Mock(Db.DbHandler)
+        self.gdriveSync._db_handler.get_page_token.return_value = 'page_token'
+
+        self.assertEqual(('new_page_token', None),
+                         self.gdriveSync._get_changed_dirs('service', '/dir', 'local_files'))
+
+        response.status = 500
+        self.assertRaises(errors.HttpError, self.gdriveSync._get_changed_dirs, 'service', '/dir', 'local_files')
+
+    def test_find_changed_dirs(self):
+        def get_local_entry(path, mtime=None, children=None):
+            return utils.LocalEntry(path.rsplit('/', 1)[1], path, mtime, children)
+
+        local_files = {'unchanged': get_local_entry('/dir/unchanged', children={
+                           'file': get_local_entry('/dir/unchanged/file', 100.5)}),
+                       'modified': get_local_entry('/dir/modified', children={
+                           'child': get_local_entry('/dir/modified/child', children={
+                               'file': get_local_entry('/dir/modified/child/file', 101.5)})}),
+                       'created': get_local_entry('/dir/created', children={}),
+                       'deleted_from': get_local_entry('/dir/deleted_from', children={}),
+                       'remote_changed': get_local_entry('/dir/remote_changed', children={
+                           'file': get_local_entry('/dir/remote_changed/file', 100)}),
+                       'remote_created': get_local_entry('/dir/remote_created', children={})}
+        changes = [{'fileId': 'remote_changed_file', 'file': {'parents': ['remote_changed_id']}},
+                   {'fileId': 'remote_created_file', 'file': {'parents': ['remote_created_id']}},
+                   {'fileId': 'outside_file', 'removed': True}]
+        self.gdriveSync._db_handler = Mock(Db.DbHandler)
+        self.gdriveSync._db_handler.get_local_modification_dates_under.return_value = {
+            '/dir/unchanged': 100,
+            '/dir/unchanged/file': 100,
+            '/dir/modified': 100,
+            '/dir/modified/child': 100,
+            '/dir/modified/child/file': 100,
+            '/dir/deleted_from': 100,
+            '/dir/deleted_from/file': 100,
+            '/dir/remote_changed': 100,
+            '/dir/remote_changed/file': 100,
+            '/dir/remote_created': 100}
+        self.gdriveSync._db_handler.get_many_local_paths.return_value = {
+            'remote_changed_file': '/dir/remote_changed/file',
+            'remote_created_id': '/dir/remote_created',
+            'outside_file': '/outside/file'}
+
+        self.assertEqual({'/dir',
+                          '/dir/modified',
+                          '/dir/modified/child',
+                          '/dir/deleted_from',
+                          '/dir/remote_changed',
+                          '/dir/remote_created'},
+                         self.gdriveSync._find_changed_dirs('/dir/', local_files, changes))
+
+        self.gdriveSync._db_handler.get_local_modification_dates_under.assert_called_once_with('/dir')
+        self.assertCountEqual(['remote_changed_file', 'remote_changed_id', 'remote_created_file',
+                               'remote_created_id', 'outside_file'],
+                              self.gdriveSync._db_handler.get_many_local_paths.call_args[0][0])
+
+    @patch('gdrive_sync.ApiBatch.ApiBatch', autospec=True)
+    @patch('gdrive_sync.utils.build_delete_file_on_remote_request', autospec=True)
     @patch('gdrive_sync.utils.create_local_dir', autospec=True)
     @patch('time.time', autospec=True)
     @patch('gdrive_sync.utils.copy_local_file_to_remote', autospec=True)
@@ -74,8 +197,12 @@ class TestGdriveSync(TestCase):
                                     mock_copy_local_file_to_remote,
                                     mock_time,
                                     mock_create_local_dir,
-                                    mock_delete_file_on_remote):
+                                    mock_build_delete_file_on_remote_request,
+                                    mock_ApiBatch):
         mocked_service = Mock()
+        mocked_batch = mock_ApiBatch.return_value
+        mocked_batch.failure_count = 0
+        mock_build_delete_file_on_remote_request.side_effect = lambda service, remote_id: 'delete ' + remote_id
 
         # remote files mock
         remote_files = iter([{'id': '1', 'name': 'file1', 'modifiedTime': 'modifiedTime1', 'mimeType': 'file'},
@@ -84,7 +211,8 @@ class TestGdriveSync(TestCase):
                               'mimeType': 'application/vnd.google-apps.folder',
                               'children': iter([{'id': '6', 'name': 'file6', 'modifiedTime': 'modifiedTime6',
                                                  'mimeType': 'file'}])},  # Dir
-                             {'id': '3', 'name': 'file3', 'modifiedTime': 'modifiedTime3', 'mimeType': 'file'},
+                             {'id': '3', 'name': 'file3', 'modifiedTime': 'modifiedTime3', 'mimeType': 'file',
+                              'md5Checksum': 'md5Checksum3'},
                              # remote file will be copied to local
                              {'id': '7', 'name': 'dir7', 'modifiedTime': 'modifiedTime7',
                               'mimeType': 'application/vnd.google-apps.folder',
@@ -100,31 +228,13 @@ class TestGdriveSync(TestCase):
                              ])
 
         # local files mock
-        local_file_mock_1 = Mock()
-        local_file_mock_1.name = 'file1'
-        local_file_mock_1.path = 'path1'
-        local_file_mock_1.stat.return_value.st_mtime = 101.11
-        local_file_mock_2 = Mock()
-        local_file_mock_2.name = 'file2'
-        local_file_mock_2.path = 'path2'
-        local_file_mock_2.stat.return_value.st_mtime = 99
-        local_file_mock_4 = Mock(name='file4', path='path4')
-        local_file_mock_4.name = 'file4'
-        local_file_mock_4.path = 'path4'
-        local_file_mock_4.stat.return_value.st_mtime = 98
-        local_dir_mock_5 = Mock(name='dir5', path='path4')
-        local_dir_mock_5.name = 'dir5'
-        local_dir_mock_5.path = 'path5'
-        local_dir_mock_5.stat.return_value.st_mtime = 97
-        local_file_mock_6 = Mock(name='file6', path='path6')
-        local_file_mock_6.name = 'file4'
-        local_file_mock_6.path = 'path4'
-        local_file_mock_6.stat.return_value.st_mtime = 96
-        local_files = [local_file_mock_1,  # local file will replace remote
-                       local_file_mock_2,  # remote file will replace local
-                       local_file_mock_4,  # local file will be copied to remote
-                       {local_dir_mock_5: [local_file_mock_6]}  # local dir
-                       ]
+        local_file_4 = utils.LocalEntry('file4', 'path4', 98, None)
+        local_files = {'file1': utils.LocalEntry('file1', 'path1', 101.11, None),  # local file will replace remote
+                       'file2': utils.LocalEntry('file2', 'path2', 99, None),  # remote file will replace local
+                       'file4': local_file_4,  # local file will be copied to remote
+                       'dir5': utils.LocalEntry('dir5', 'path5', 97, {
+                           'file4': utils.LocalEntry('file4', 'path4', 96, None)})  # local dir
+                       }
         # utils mocks
         mock_convert_rfc3339_time_to_epoch.return_value = 100
         mock_copy_local_file_to_remote.return_value = '4'
@@ -138,27 +248,30 @@ class TestGdriveSync(TestCase):
         self.gdriveSync._db_handler.get_local_modification_date.return_value = 80
         self.gdriveSync._db_handler.get_remote_modification_date.return_value = 80
 
-        def get_local_file_path_effect(arg):
-            if arg in ['9', '11']:
-                return 'file_path'
-            return None
-
-        self.gdriveSync._db_handler.get_local_file_path.side_effect = get_local_file_path_effect
+        self.gdriveSync._db_handler.get_many_local_paths.side_effect = \
+            lambda remote_ids: {remote_id: 'file_path' for remote_id in remote_ids if remote_id in ['9', '11']}
 
         # actual method call
-        self.gdriveSync._compare_and_sync_files(mocked_service,
-                                                remote_files,
-                                                'remote_parent_dir_id1',
-                                                local_files,
-                                                'local_parent_dir1')
+        self.assertTrue(self.gdriveSync._compare_and_sync_files(mocked_service,
+                                                                remote_files,
+                                                                'remote_parent_dir_id1',
+                                                                local_files,
+                                                                'local_parent_dir1'))
+        self.assertTrue(self.gdriveSync._wait_for_dir_syncs())
+        for add_call in mocked_batch.add.call_args_list:
+            add_call[0][1]('response')
 
         # assertions
         mock_convert_rfc3339_time_to_epoch.assert_has_calls([call('modifiedTime1'),
                                                              call('modifiedTime2'),
+                                                             call('modifiedTime5'),
                                                              call('modifiedTime6'),
                                                              call('modifiedTime3'),
                                                              call('modifiedTime7'),
-                                                             call('modifiedTime8'), ])
+                                                             call('modifiedTime8'),
+                                                             call('modifiedTime9'),
+                                                             call('modifiedTime11')],
+                                                            any_order=True)
         mock_overwrite_remote_file_with_local.assert_called_once_with(mocked_service,
                                                                       '1',
                                                                       'path1')
@@ -173,65 +286,99 @@ class TestGdriveSync(TestCase):
                                                               '3'),
                                                          call(mocked_service,
                                                               'local_parent_dir1/dir7/file8',
-                                                              '8')])
+                                                              '8')],
+                                                        any_order=True)
         mock_create_local_dir.assert_called_once_with('local_parent_dir1/dir7')
-        mock_delete_file_on_remote.assert_has_calls([call('9'), call('11')])
-
-        self.gdriveSync._db_handler.insert_record.assert_has_calls([call('path1', '1', 101, 99999999),
-                                                                    call('path2', '2', 99999999, 100),
-                                                                    call('local_parent_dir1/dir5/file6', '6', 99999999,
-                                                                         100),
-                                                                    call('local_parent_dir1/file3', '3', 99999999, 100),
-                                                                    call('local_parent_dir1/dir7', '7', 99999999, 100),
-                                                                    call('local_parent_dir1/dir7/file8', '8', 99999999,
-                                                                         100)])
+        mock_build_delete_file_on_remote_request.assert_has_calls([call(mocked_service, '9'),
+                                                                   call(mocked_service, '11')])
+        mocked_batch.add.assert_has_calls([call('delete 9', ANY), call('delete 11', ANY)])
+        mock_ApiBatch.assert_has_calls([call(mocked_service)] * 3, any_order=True)
+        self.assertEqual(3, mocked_batch.execute.call_count)
+
+        self.gdriveSync._db_handler.get_many_local_paths.assert_has_calls([call(['1', '2', '5', '3', '7', '9', '11']),
+                                                                           call(['6']),
+                                                                           call(['8'])],
+                                                                          any_order=True)
+        self.gdriveSync._db_handler.insert_many.assert_has_calls([call([('local_parent_dir1/dir5/file6', '6', 99999999,
+                                                                         100, None)]),
+                                                                  call([('local_parent_dir1/dir7/file8', '8', 99999999,
+                                                                         100, None)]),
+                                                                  call([('local_parent_dir1/dir7', '7', 99999999, 100,
+                                                                         None),
+                                                                        ('path1', '1', 101, 99999999, None),
+                                                                        ('path2', '2', 99999999, 100, None),
+                                                                        ('local_parent_dir1/file3', '3', 99999999,
+                                                                         100, 'md5Checksum3')])],
+                                                                 any_order=True)
         self.gdriveSync._db_handler.get_local_modification_date.assert_called_once_with('path1')
         self.gdriveSync._db_handler.get_remote_modification_date.assert_called_once_with('2')
         self.gdriveSync._db_handler.delete_record.assert_has_calls([call('local_parent_dir1/dir9'),
                                                                     call('local_parent_dir1/file11')])
-        self.gdriveSync._copy_local_to_remote.assert_has_calls([call({'file4': local_file_mock_4},
+        self.gdriveSync._copy_local_to_remote.assert_has_calls([call({'file4': local_file_4},
                                                                      'remote_parent_dir_id1',
-                                                                     mocked_service)])
+                                                                     mocked_service,
+                                                                     mocked_batch,
+                                                                     ANY,
+                                                                     ANY)])
+
+    @patch('gdrive_sync.ApiBatch.ApiBatch', autospec=True)
+    def test_compare_and_sync_files_with_changed_dirs(self, mock_ApiBatch):
+        mock_ApiBatch.return_value.failure_count = 0
+        remote_files = [{'id': '1', 'name': 'dir1', 'modifiedTime': '2017-06-28T03:25:20.954Z',
+                         'mimeType': 'application/vnd.google-apps.folder', 'children': 'children1'},
+                        {'id': '2', 'name': 'dir2', 'modifiedTime': '2017-06-28T03:25:20.954Z',
+                         'mimeType': 'application/vnd.google-apps.folder', 'children': 'children2'}]
+        local_files = {'dir1': utils.LocalEntry('dir1', '/dir/dir1', 100, 'local_children1'),
+                       'dir2': utils.LocalEntry('dir2', '/dir/dir2', 100, 'local_children2')}
+        self.gdriveSync._db_handler = Mock(Db.DbHandler)
+        self.gdriveSync._db_handler.get_many_local_paths.return_value = {}
+        self.gdriveSync._copy_local_to_remote = Mock()
+        self.gdriveSync._submit_dir_sync = Mock()
+
+        self.assertTrue(self.gdriveSync._compare_and_sync_files('service',
+                                                                remote_files,
+                                                                'remote_parent_dir_id',
+                                                                local_files,
+                                                                '/dir',
+                                                                {'/dir', '/dir/dir2'}))
+
+        self.gdriveSync._submit_dir_sync.assert_called_once_with('service',
+                                                                 'children2',
+                                                                 '2',
+                                                                 'local_children2',
+                                                                 '/dir/dir2',
+                                                                 {'/dir', '/dir/dir2'})
+        self.gdriveSync._copy_local_to_remote.assert_called_once_with({}, 'remote_parent_dir_id', 'service',
+                                                                      mock_ApiBatch.return_value, [], [])
 
     @patch('gdrive_sync.utils.delete_file_from_local', autospec=True)
     @patch('time.time', autospec=True)
     @patch('gdrive_sync.utils.copy_local_file_to_remote', autospec=True)
-    @patch('gdrive_sync.utils.create_remote_dir', autospec=True)
+    @patch('gdrive_sync.utils.build_create_remote_dir_request', autospec=True)
     def test_copy_local_to_remote(self,
-                                  mock_create_remote_dir,
+                                  mock_build_create_remote_dir_request,
                                   mock_copy_local_file_to_remote,
                                   mock_time,
                                   mock_delete_file_from_local):
         mocked_service = Mock()
-
-        local_file_mock_1 = Mock()
-        local_file_mock_1.name = 'file1'
-        local_file_mock_1.path = 'path1'
-        local_file_mock_1.stat.return_value.st_mtime = 98
-        local_dir_mock_2 = Mock()
-        local_dir_mock_2.name = 'dir2'
-        local_dir_mock_2.path = 'path2'
-        local_dir_mock_2.stat.return_value.st_mtime = 97
-        local_file_mock_3 = Mock()
-        local_file_mock_3.name = 'file3'
-        local_file_mock_3.path = 'path3'
-        local_file_mock_3.stat.return_value.st_mtime = 96
-        local_file_mock_4 = Mock()
-        local_file_mock_4.name = 'file4'
-        local_file_mock_4.path = 'path4'
-        local_dir_mock_5 = Mock()
-        local_dir_mock_5.name = 'dir5'
-        local_dir_mock_5.path = 'path5'
-        local_file_mock_6 = Mock()
-        local_file_mock_6.name = 'file6'
-        local_file_mock_6.path = 'path6'
-        local_files = {'dir2': {local_dir_mock_2: [local_file_mock_3]},
-                       'file1': local_file_mock_1,
-                       'dir5': {local_dir_mock_5: [local_file_mock_6]},
-                       'file4': local_file_mock_4}
+        mocked_batch = Mock(ApiBatch.ApiBatch)
+        batched_callbacks = []
+        mocked_batch.add.side_effect = lambda request, callback: batched_callbacks.append(callback)
+
+        def execute_batch():
+            while batched_callbacks:
+                batched_callbacks.pop(0)({'id': '2'})
+        mocked_batch.execute.side_effect = execute_batch
+
+        local_files = {'dir2': utils.LocalEntry('dir2', 'path2', 97, {
+                           'file3': utils.LocalEntry('file3', 'path3', 96, None)}),
+                       'file1': utils.LocalEntry('file1', 'path1', 98, None),
+                       'dir5': utils.LocalEntry('dir5', 'path5', 95, {
+                           'file6': utils.LocalEntry('file6', 'path6', 94, None)}),
+                       'file4': utils.LocalEntry('file4', 'path4', 93, None)}
 
         mock_copy_local_file_to_remote.return_value = '1'
-        mock_create_remote_dir.return_value = '2'
+        mock_build_create_remote_dir_request.return_value = 'create request'
         mock_time.return_value = 99999999.99
 
         self.gdriveSync._db_handler = Mock(Db.DbHandler)
@@ -244,9 +391,18 @@ class TestGdriveSync(TestCase):
 
         self.gdriveSync._db_handler.get_remote_file_id.side_effect = get_remote_file_id_side_effect
 
-        self.gdriveSync._copy_local_to_remote(local_files, 'remote_parent_dir_id', mocked_service)
-
-        mock_create_remote_dir.assert_called_once_with('dir2', 'remote_parent_dir_id')
+        transfers = []
+        records = []
+        self.gdriveSync._copy_local_to_remote(local_files,
+                                              'remote_parent_dir_id',
+                                              mocked_service,
+                                              mocked_batch,
+                                              transfers,
+                                              records)
+        records.extend(self.gdriveSync._wait_for_transfers(transfers))
+
+        mock_build_create_remote_dir_request.assert_called_once_with(mocked_service, 'dir2', 'remote_parent_dir_id')
+        mocked_batch.add.assert_called_once_with('create request', ANY)
         mock_copy_local_file_to_remote.assert_has_calls([call('path3',
                                                               '2',
                                                               mocked_service),
@@ -254,10 +410,10 @@ class TestGdriveSync(TestCase):
                                                               'remote_parent_dir_id',
                                                               mocked_service)],
                                                         any_order=True)
-        self.gdriveSync._db_handler.insert_record.assert_has_calls([call('path1', '1', 98, 99999999),
-                                                                    call('path2', '2', 97, 99999999),
-                                                                    call('path3', '1', 96, 99999999)],
-                                                                   any_order=True)
+        self.assertCountEqual([('path1', '1', 98, 99999999, None),
+                               ('path2', '2', 97, 99999999, None),
+                               ('path3', '1', 96, 99999999, None)],
+                              records)
         mock_delete_file_from_local.assert_has_calls([call('path5'),
                                                       call('path4')],
                                                      any_order=True)
@@ -265,6 +421,66 @@ class TestGdriveSync(TestCase):
                                                                     call('path4')],
                                                                    any_order=True)
 
+    def test_wait_for_dir_syncs(self):
+        def compare_and_sync_files(service, remote_files, remote_dir_id, local_files, local_dir):
+            if local_dir == 'local_dir1':
+                # queues a subdir while being synced
+                self.gdriveSync._submit_dir_sync(service, 'remote_files3', 'remote_id3', 'local_files3', 'local_dir3')
+            elif local_dir == 'local_dir2':
+                raise Exception('Sync failed')
+            elif local_dir == 'local_dir4':
+                return False
+            return True
+        self.gdriveSync._compare_and_sync_files = Mock(side_effect=compare_and_sync_files)
+
+        self.gdriveSync._submit_dir_sync('service', 'remote_files1', 'remote_id1', 'local_files1', 'local_dir1')
+        self.gdriveSync._submit_dir_sync('service', 'remote_files2', 'remote_id2', 'local_files2', 'local_dir2')
+        self.assertFalse(self.gdriveSync._wait_for_dir_syncs())
+        self.assertEqual(3, self.gdriveSync._compare_and_sync_files.call_count)
+        self.gdriveSync._compare_and_sync_files.assert_any_call('service', 'remote_files3', 'remote_id3',
+                                                                'local_files3', 'local_dir3')
+
+        self.gdriveSync._submit_dir_sync('service', 'remote_files4', 'remote_id4', 'local_files4', 'local_dir4')
+        self.assertFalse(self.gdriveSync._wait_for_dir_syncs())
+
+        self.gdriveSync._submit_dir_sync('service', 'remote_files5', 'remote_id5', 'local_files5', 'local_dir5')
+        self.assertTrue(self.gdriveSync._wait_for_dir_syncs())
+        self.assertEqual(5, self.gdriveSync._compare_and_sync_files.call_count)
+
+    @patch('time.time', autospec=True)
+    def test_wait_for_transfers(self, mock_time):
+        mock_time.return_value = 99999999.99
+        failing_transfer = Mock(side_effect=Exception('Transfer failed'))
+        transfers = []
+
+        self.gdriveSync._submit_transfer(transfers, Mock(return_value='id1'), (), 'path1', local_modification_date=98)
+        self.gdriveSync._submit_transfer(transfers, failing_transfer, ('arg',), 'path2', remote_id='id2')
+        self.gdriveSync._submit_transfer(transfers, Mock(), (), 'path3', remote_id='id3', remote_modification_date=97,
+                                         content_hash='hash3')
+
+        self.assertEqual([('path1', 'id1', 98, 99999999, None),
+                          ('path3', 'id3', 99999999, 97, 'hash3')],
+                         self.gdriveSync._wait_for_transfers(transfers))
+        failing_transfer.assert_called_once_with('arg')
+
+    @patch('gdrive_sync.utils.get_md5_checksum', autospec=True)
+    def test_transfer_if_content_differs(self, mock_get_md5_checksum):
+        mock_get_md5_checksum.return_value = 'local_md5'
+        transfer = Mock(return_value='transferred')
+
+        self.assertIsNone(self.gdriveSync._transfer_if_content_differs(transfer, ('arg',), 'path', 'local_md5'))
+        transfer.assert_not_called()
+
+        self.assertEqual('transferred',
+                         self.gdriveSync._transfer_if_content_differs(transfer, ('arg',), 'path', 'remote_md5'))
+        transfer.assert_called_once_with('arg')
+        mock_get_md5_checksum.assert_has_calls([call('path'), call('path')])
+
+        # google docs have no checksum
+        mock_get_md5_checksum.reset_mock()
+        self.gdriveSync._transfer_if_content_differs(transfer, ('arg',), 'path', None)
+        mock_get_md5_checksum.assert_not_called()
+
     @patch('gdrive_sync.utils.get_service', autospec=True)
     def test_sync_onetime(self, mocked_get_service):
         mocked_get_service.return_value = 'service'
@@ -276,18 +492,20 @@ class TestGdriveSync(TestCase):
         self.gdriveSync._process_dir_pairs.assert_called_once_with('service', 'synced_dirs_dict')
 
     @patch('watchdog.observers.Observer', autospec=True)
+    @patch('gdrive_sync.DebouncedEventHandler.DebouncedEventHandler', autospec=True)
     @patch('gdrive_sync.LocalFSEventHandler.LocalFSEventHandler', autospec=True)
-    def test_watch_local_dir(self, mock_LocalFSEventHandler, mock_observer):
+    def test_watch_local_dir(self, mock_LocalFSEventHandler, mock_DebouncedEventHandler, mock_observer):
         mock_LocalFSEventHandler.return_value = 'event_hanlder'
 
         self.assertEqual(mock_observer.return_value,
                          self.gdriveSync._watch_local_dir('dir_to_watch'))
 
         mock_LocalFSEventHandler.assert_called_once_with(self.gdriveSync._db_handler)
+        mock_DebouncedEventHandler.assert_called_once_with('event_hanlder', 0.5, 4)
         mock_observer.assert_called_once_with()
-        mock_observer.return_value.schedule('event_handler',
-                                            'dir_to_watch',
-                                            recursive=True)
+        mock_observer.return_value.schedule.assert_called_once_with(mock_DebouncedEventHandler.return_value,
+                                                                    'dir_to_watch',
+                                                                    recursive=True)
 
         mock_observer.return_value.start.assert_called_once_with()
 
@@ -1,6 +1,10 @@
 import os
+import threading
+import itertools
+import hashlib
+import time
 from unittest import TestCase
-from unittest.mock import Mock, patch, MagicMock, call, create_autospec
+from unittest.mock import Mock, patch, MagicMock, call, create_autospec, ANY
 
 from gdrive_sync import utils
 
@@ -31,34 +35,50 @@ class TestUtils(TestCase):
 
         mocked_service.files.assert_called_once_with()
         mocked_service.files.return_value.list.assert_called_once_with(
-            q="query", corpora="user", fields="fields", pageToken=None)
+            q="query", corpora="user", fields="fields", pageToken=None, pageSize=None)
         mocked_service.files.return_value.list.return_value.execute.assert_called_once_with()
 
     @patch('os.scandir', autospec=True)
     def test_list_files_under_local_dir(self, mock_scandir):
         mock_direntry_1 = Mock()
+        mock_direntry_1.name = 'file1'
+        mock_direntry_1.path = 'dir_path/file1'
+        mock_direntry_1.stat.return_value.st_mtime = 101.5
         mock_direntry_1.is_dir.return_value = False
         mock_direntry_2 = Mock()
+        mock_direntry_2.name = 'dir2'
         mock_direntry_2.is_dir.return_value = True
         mock_direntry_2.path = '/path/to/some/dir'
+        mock_direntry_2.stat.return_value.st_mtime = 102
         mock_direntry_3 = Mock()
+        mock_direntry_3.name = 'file3'
+        mock_direntry_3.path = '/path/to/some/dir/file3'
+        mock_direntry_3.stat.return_value.st_mtime = 103
         mock_direntry_3.is_dir.return_value = False
         mock_scandir.side_effect = [[mock_direntry_1, mock_direntry_2], [mock_direntry_3]]
 
-        # self.assertEqual([mock_direntry_1, {mock_direntry_2: [mock_direntry_3]}],
-        #                  utils.list_files_under_local_dir('dir_path'))
-        result_iter = utils.list_files_under_local_dir('dir_path')
-
-        self.assertEqual(mock_direntry_1, next(result_iter))
-        tmp_next = next(result_iter)
-        key = next(iter(tmp_next))
-        self.assertEqual(mock_direntry_2, key)
-        self.assertEqual(mock_direntry_3, next(tmp_next[key]))
+        self.assertEqual({'file1': utils.LocalEntry('file1', 'dir_path/file1', 101.5, None),
+                          'dir2': utils.LocalEntry('dir2', '/path/to/some/dir', 102, {
+                              'file3': utils.LocalEntry('file3', '/path/to/some/dir/file3', 103, None)})},
+                         utils.list_files_under_local_dir('dir_path'))
 
         mock_scandir.assert_has_calls([call(path='dir_path'), call(path='/path/to/some/dir')])
 
     def test_convert_rfc3339_time_to_epoch(self):
         self.assertEqual(1498620320, utils.convert_rfc3339_time_to_epoch('2017-06-28T03:25:20.954Z'))
+        self.assertEqual(1498620320, utils.convert_rfc3339_time_to_epoch('2017-06-28T03:25:20Z'))
+        self.assertEqual(1498620320, utils.convert_rfc3339_time_to_epoch('2017-06-28T08:55:20.954+05:30'))
+
+    @patch('gdrive_sync.utils.parse', autospec=True)
+    def test_convert_rfc3339_time_to_epoch_cached(self, mock_parse):
+        mock_parse.return_value.timestamp.return_value = 1498620320.954
+        utils.convert_rfc3339_time_to_epoch.cache_clear()
+
+        self.assertEqual(1498620320, utils.convert_rfc3339_time_to_epoch('2017-06-28T03:25:20.954-00:00'))
+        self.assertEqual(1498620320, utils.convert_rfc3339_time_to_epoch('2017-06-28T03:25:20.954-00:00'))
+
+        mock_parse.assert_called_once_with(timestamp='2017-06-28T03:25:20.954-00:00')
+        utils.convert_rfc3339_time_to_epoch.cache_clear()
 
     def test_convert_epoch_time_to_rfc3339(self):
         self.assertEqual('2017-06-28T03:25:20Z', utils.convert_epoch_time_to_rfc3339(1498620320))
@@ -75,10 +95,22 @@ class TestUtils(TestCase):
         mocked_service.files.assert_called_once_with()
         mocked_service.files.return_value.update.assert_called_once_with(fileId='test id',
                                                                          media_body='test path',
-                                                                         media_mime_type='test_mime_type')
+                                                                         media_mime_type='test_mime_type',
+                                                                         fields='id')
         mocked_service.files.return_value.update.return_value.execute.assert_called_once_with()
         mocked_magic.assert_called_once_with('test path', True)
 
+    def test_get_md5_checksum(self):
+        with open('/tmp/gdrive_test.txt', 'wb') as file:
+            file.write(b'test content')
+
+        self.assertEqual('9473fdd0d880a43c21b7778d34872157', utils.get_md5_checksum('/tmp/gdrive_test.txt'))
+        # python versions older than 3.11 do not have hashlib.file_digest
+        with patch('gdrive_sync.utils.hashlib', Mock(spec=['md5'], md5=hashlib.md5)), \
+                patch('gdrive_sync.utils._HASH_CHUNK_SIZE', 5):
+            self.assertEqual('9473fdd0d880a43c21b7778d34872157', utils.get_md5_checksum('/tmp/gdrive_test.txt'))
+        os.remove('/tmp/gdrive_test.txt')
+
     def test_copy_remote_file_to_local(self):
         mocked_service = Mock()
         mocked_service.files.return_value.get_media.return_value.execute.return_value = b'test content'
@@ -116,7 +148,8 @@ class TestUtils(TestCase):
         mocked_service.files.return_value.create.assert_called_once_with(
             body={'parents': ['test_remote_parent_dir_id'], 'name': 'file'},
             media_body='/path/to/local/file',
-            media_mime_type='test_mime_type')
+            media_mime_type='test_mime_type',
+            fields='id')
         mocked_service.files.return_value.create.return_value.execute.assert_called_once_with()
         check_and_get_service_mock.assert_called_once_with('service')
         mocked_magic.assert_called_once_with('/path/to/local/file', True)
@@ -132,17 +165,22 @@ class TestUtils(TestCase):
         mocked_list_drive_files = Mock(side_effect=[mocked_result_1, mocked_result_2])
 
         with patch('gdrive_sync.utils.list_drive_files', mocked_list_drive_files):
-            self.assertEqual(['file3', 'file4', 'file1', 'file2'],
-                             [x for x in utils.get_remote_files_from_dir(mocked_service, 'test_parent_dir_id')])
+            result_iter = utils.get_remote_files_from_dir(mocked_service, 'test_parent_dir_id')
+            self.assertEqual(['file1', 'file2'], [next(result_iter), next(result_iter)])
+            # the next page is not requested before the first page is consumed
+            self.assertEqual(1, mocked_list_drive_files.call_count)
+            self.assertEqual(['file3', 'file4'], list(result_iter))
 
         calls = [call(mocked_service,
-                      'nextPageToken, files(id, name, modifiedTime, mimeType)',
+                      'nextPageToken, files(id, name, modifiedTime, mimeType, md5Checksum)',
                       query="'test_parent_dir_id' in parents and trashed = false",
-                      next_page_token=None),
+                      next_page_token=None,
+                      page_size=utils.REMOTE_PAGE_SIZE),
                  call(mocked_service,
-                      'nextPageToken, files(id, name, modifiedTime, mimeType)',
+                      'nextPageToken, files(id, name, modifiedTime, mimeType, md5Checksum)',
                       query="'test_parent_dir_id' in parents and trashed = false",
-                      next_page_token='nextPageToken')]
+                      next_page_token='nextPageToken',
+                      page_size=utils.REMOTE_PAGE_SIZE)]
         mocked_list_drive_files.assert_has_calls(calls)
 
     @patch('gdrive_sync.utils.get_remote_files_from_dir', autospec=True)
@@ -158,6 +196,65 @@ class TestUtils(TestCase):
         self.assertEqual(mock_dir, next(result_iter))
         self.assertEqual(mock_file, next(mock_dir['children']))
 
+    def test_prefetch(self):
+        self.assertEqual(list(range(10)), list(utils.prefetch(iter(range(10)), 2)))
+        self.assertEqual([], list(utils.prefetch([], 2)))
+
+    def test_prefetch_error(self):
+        def failing_generator():
+            yield 'file1'
+            raise ValueError('failed')
+
+        result_iter = utils.prefetch(failing_generator(), 2)
+
+        self.assertEqual('file1', next(result_iter))
+        self.assertRaises(ValueError, next, result_iter)
+
+    def test_prefetch_close(self):
+        fetched = []
+
+        def endless_generator():
+            for i in itertools.count():
+                fetched.append(i)
+                yield i
+
+        result_iter = utils.prefetch(endless_generator(), 2)
+        self.assertEqual(0, next(result_iter))
+        result_iter.close()
+        time.sleep(0.3)
+        fetched_count = len(fetched)
+        time.sleep(0.3)
+
+        # the producer stops fetching once the consumer is closed
+        self.assertEqual(fetched_count, len(fetched))
+        self.assertLessEqual(fetched_count, 5)
+
+    def test_get_start_page_token(self):
+        mocked_service = Mock()
+        mocked_service.changes.return_value.getStartPageToken.return_value.execute.return_value = \
+            {'startPageToken': 'token'}
+
+        self.assertEqual('token', utils.get_start_page_token(mocked_service))
+
+    def test_list_changes(self):
+        mocked_service = Mock()
+        mocked_service.changes.return_value.list.return_value.execute.side_effect = [
+            {'changes': [{'fileId': 'id1'}], 'nextPageToken': 'token2'},
+            {'changes': [{'fileId': 'id2', 'removed': True}], 'newStartPageToken': 'token3'}]
+
+        self.assertEqual(([{'fileId': 'id1'}, {'fileId': 'id2', 'removed': True}], 'token3'),
+                         utils.list_changes(mocked_service, 'token1'))
+
+        fields = 'nextPageToken, newStartPageToken, changes(fileId, removed, file(parents))'
+        mocked_service.changes.return_value.list.assert_has_calls([call(pageToken='token1',
+                                                                        pageSize=1000,
+                                                                        fields=fields),
+                                                                   call().execute(),
+                                                                   call(pageToken='token2',
+                                                                        pageSize=1000,
+                                                                        fields=fields),
+                                                                   call().execute()])
+
     def test_get_remote_dir(self):
         mocked_service = Mock()
         mocked_result_1 = {'files': [{'id': 'id_1', 'modifiedTime': ', modifiedTime_1'}]}
@@ -232,7 +329,28 @@ class TestUtils(TestCase):
         mocked_get_credentials.assert_called_once_with()
         http_mock.assert_called_once_with()
         mocked_credentials.authorize.assert_called_once_with('http11')
-        mocked_build.assert_called_once_with('drive', 'v3', http='authorized')
+        mocked_build.assert_called_once_with('drive', 'v3', http='authorized', requestBuilder=ANY)
+
+    @patch('googleapiclient.http.HttpRequest', autospec=True)
+    @patch('httplib2.Http', autospec=True)
+    @patch('googleapiclient.discovery.build', autospec=True)
+    @patch('gdrive_sync.utils.get_credentials', autospec=True)
+    def test_get_service_request_builder(self, mocked_get_credentials, mocked_build, http_mock, mocked_http_request):
+        mocked_credentials = Mock()
+        mocked_get_credentials.return_value = mocked_credentials
+        mocked_credentials.authorize.side_effect = ['authorized', 'authorized_thread_1', 'authorized_thread_2']
+
+        utils.get_service()
+        build_request = mocked_build.call_args[1]['requestBuilder']
+        build_request('authorized', 'postproc', 'uri')
+        build_request('authorized', 'postproc', 'uri')
+        thread = threading.Thread(target=build_request, args=('authorized', 'postproc', 'uri'))
+        thread.start()
+        thread.join()
+
+        mocked_http_request.assert_has_calls([call('authorized_thread_1', 'postproc', 'uri'),
+                                              call('authorized_thread_1', 'postproc', 'uri'),
+                                              call('authorized_thread_2', 'postproc', 'uri')])
 
     @patch('os.stat', autospec=True)
     def test_get_inode_no(self, os_stat_mock):
@@ -264,6 +382,28 @@ class TestUtils(TestCase):
         mocked_service.files.return_value.delete.assert_called_once_with(fileId='remote_file_id')
         mocked_service.files.return_value.delete.return_value.execute.assert_called_once_with()
 
+    def test_build_delete_file_on_remote_request(self):
+        mocked_service = Mock()
+
+        self.assertEqual(mocked_service.files.return_value.delete.return_value,
+                         utils.build_delete_file_on_remote_request(mocked_service, 'remote_file_id'))
+
+        mocked_service.files.return_value.delete.assert_called_once_with(fileId='remote_file_id')
+        mocked_service.files.return_value.delete.return_value.execute.assert_not_called()
+
+    def test_build_create_remote_dir_request(self):
+        mocked_service = Mock()
+
+        self.assertEqual(mocked_service.files.return_value.create.return_value,
+                         utils.build_create_remote_dir_request(mocked_service, 'dir', 'parent_dir_id'))
+
+        mocked_service.files.return_value.create.assert_called_once_with(
+            body={'parents': ['parent_dir_id'],
+                  'name': 'dir',
+                  'mimeType': 'application/vnd.google-apps.folder'},
+            fields='id')
+        mocked_service.files.return_value.create.return_value.execute.assert_not_called()
+
     @patch('magic.from_file', autospec=True)
     @patch('gdrive_sync.utils.check_and_get_service', autospec=True)
     def test_update_remote_file(self, mock_check_and_get_service, mocked_magic):
@@ -277,7 +417,8 @@ class TestUtils(TestCase):
         mocked_service.files.assert_called_once_with()
         mocked_service.files.return_value.update.assert_called_once_with(fileId='remote_file_id',
                                                                          media_body='local_file_path',
-                                                                         media_mime_type='test_mime_type')
+                                                                         media_mime_type='test_mime_type',
+                                                                         fields='id')
         mocked_service.files.return_value.update.return_value.execute.assert_called_once_with()
         mocked_magic.assert_called_once_with('local_file_path', True)
 
@@ -1,6 +1,13 @@
 import os
 import logging
 import shutil
+import threading
+import queue
+import calendar
+import functools
+import re
+import collections
+import hashlib
 
 from gdrive_sync import configs
 import json
@@ -10,11 +17,23 @@ from oauth2client import file
 from oauth2client import tools, client
 from os import path
 import httplib2
-from googleapiclient import discovery
+from googleapiclient import discovery, http as googleapiclient_http
 import magic
 
 _user_settings_template = {'synced_dirs': {}}
 
+# The max number of files google drive returns in a single page of files.list
+REMOTE_PAGE_SIZE = 1000
+# The size of the chunks the local files are read in while hashing
+_HASH_CHUNK_SIZE = 64 * 1024
+
+# The format of the timestamps returned by google drive, e.g. 2017-06-28T03:25:20.954Z
+_drive_time_pattern = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?Z')
+
+# A file or dir in local filesystem. children is None for a file, for a dir it is
+# the dict of the entries under that dir.
+LocalEntry = collections.namedtuple('LocalEntry', ['name', 'path', 'mtime', 'children'])
+
 
 class _Flags:
     logging_level = configs.get_config('LOGGING', 'log_level')
@@ -73,37 +92,51 @@ def store_user_settings(settings):
         json.dump(settings, _file)
 
 
-def list_drive_files(service, fields, query=None, next_page_token=None):
+def list_drive_files(service, fields, query=None, next_page_token=None, page_size=None):
     """
     Gets the results from google drive with the input parameters
     """
-    return service.files().list(q=query, corpora="user", fields=fields, pageToken=next_page_token).execute()
+    return service.files().list(q=query,
+                                corpora="user",
+                                fields=fields,
+                                pageToken=next_page_token,
+                                pageSize=page_size).execute()
 
 
 def list_files_under_local_dir(dir_path):
     """
-    Lists the files as os.DirEntry under a dir in local filesystem.
-    If the file is a dir, it creates a map for that entry where the key is
-    the os.DirEntry for that dir and the value is the list of files under
-    that dir.
-    :return Generator of os.DirEntry and dict if file is dir
+    Lists the files under a dir in local filesystem recursively.
+    The modification time is read once while scanning, so the sync does not stat the files again.
+    :return A dict of file name vs LocalEntry
     """
-    files = os.scandir(path=dir_path)
-    for each in files:
-        if each.is_dir():
-            yield {each: list_files_under_local_dir(each.path)}
-        else:
-            yield each
+    files = {}
+    for each in os.scandir(path=dir_path):
+        files[each.name] = LocalEntry(each.name,
+                                      each.path,
+                                      each.stat().st_mtime,
+                                      list_files_under_local_dir(each.path) if each.is_dir() else None)
+    return files
 
 
-def convert_rfc3339_time_to_epoch(timestamp):  # TODO: Modify test
+@functools.lru_cache(maxsize=4096)
+def convert_rfc3339_time_to_epoch(timestamp):
     """
-    Converts rfc3339 time to epoch timestamps
+    Converts rfc3339 time to epoch timestamps.
+    The UTC timestamps returned by google drive are parsed by slicing the fixed
+    positions, which is much faster than the generic rfc3339 parser. The results
+    are cached, as the same timestamps repeat across the syncs for unchanged files.
     Args:
         timestamp: 'A string' in rfc3339 format
     Returns:
         Integer, the converted epoch timestamp
     """
+    if _drive_time_pattern.fullmatch(timestamp):
+        return calendar.timegm((int(timestamp[0:4]),
+                                int(timestamp[5:7]),
+                                int(timestamp[8:10]),
+                                int(timestamp[11:13]),
+                                int(timestamp[14:16]),
+                                int(timestamp[17:19])))
     return int(parse(timestamp=timestamp).timestamp())
 
 
@@ -118,6 +151,24 @@ def convert_epoch_time_to_rfc3339(timestamp):
     return generate(datetime.utcfromtimestamp(timestamp), accept_naive=True)
 
 
+def get_md5_checksum(file_path):
+    """
+    Calculates the md5 checksum of a local file, which google drive returns as md5Checksum
+    for the binary files.
+    Args:
+        file_path: 'A String' path of the local file
+    Returns:
+        'A String' hex digest of the file content
+    """
+    with open(file_path, 'rb') as _file:
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(_file, 'md5').hexdigest()
+        md5 = hashlib.md5()
+        for chunk in iter(lambda: _file.read(_HASH_CHUNK_SIZE), b''):
+            md5.update(chunk)
+        return md5.hexdigest()
+
+
 def overwrite_remote_file_with_local(service, remote_file_id, local_file_path):
     """
     Overwrites the remote file with the local file.
@@ -128,7 +179,8 @@ def overwrite_remote_file_with_local(service, remote_file_id, local_file_path):
     """
     return service.files().update(fileId=remote_file_id,
                                   media_body=local_file_path,
-                                  media_mime_type=magic.from_file(local_file_path, True)).execute()
+                                  media_mime_type=magic.from_file(local_file_path, True),
+                                  fields='id').execute()
 
 
 def copy_remote_file_to_local(service, local_file_path, remote_file_id):
@@ -158,7 +210,8 @@ def copy_local_file_to_remote(local_file_path, remote_parent_dir_id, service=Non
                                                                'name': os.path.basename(local_file_path)},
                                                          media_body=local_file_path,
                                                          media_mime_type=magic.from_file(local_file_path,
-                                                                                         True)).execute()['id']
+                                                                                         True),
+                                                         fields='id').execute()['id']
 
 
 def create_remote_dir(name, parent_dir, service=None):
@@ -169,16 +222,28 @@ def create_remote_dir(name, parent_dir, service=None):
     :param service: A googleapiclient.discovery.Resource object
     :return: the id of the created remote dir
     """
-    return check_and_get_service(service).files().create(body={'parents': [parent_dir],
-                                                               'name': name,
-                                                               'mimeType': 'application/vnd.google-apps.folder'})\
-        .execute()['id']
+    return build_create_remote_dir_request(check_and_get_service(service), name, parent_dir).execute()['id']
+
+
+def build_create_remote_dir_request(service, name, parent_dir):
+    """
+    Builds the request for creating a dir at remote without executing it,
+    so that it can be added to an ApiBatch.
+    :param service: A googleapiclient.discovery.Resource object
+    :param name: remote dir name
+    :param parent_dir: remote parent dir id
+    :return: A googleapiclient.http.HttpRequest object, the response of which has the 'id' of the created dir
+    """
+    return service.files().create(body={'parents': [parent_dir],
+                                        'name': name,
+                                        'mimeType': 'application/vnd.google-apps.folder'},
+                                  fields='id')
 
 
 def get_remote_files_from_dir(service, parent_dir_id, next_page_token=None):
     """
     Gets the remote file information from remote, returns file with
-    id, name, modifiedTime, mimeType fields. For most of the use-cases, list_remote_files_from_dir
+    id, name, modifiedTime, mimeType fields and md5Checksum for the binary files. For most of the use-cases, list_remote_files_from_dir
     is a more suitable option.
     Args:
         service: A googleapiclient.discovery.Resource object
@@ -187,14 +252,18 @@ def get_remote_files_from_dir(service, parent_dir_id, next_page_token=None):
     Results:
         A generator of files dir object
     """
-    results = list_drive_files(service,
-                               'nextPageToken, files(id, name, modifiedTime, mimeType)',
-                               query="'{}' in parents and trashed = false".format(parent_dir_id),
-                               next_page_token=next_page_token)
-    if 'nextPageToken' in results:
-        yield from get_remote_files_from_dir(service, parent_dir_id, results['nextPageToken'])
+    while True:
+        results = list_drive_files(service,
+                                   'nextPageToken, files(id, name, modifiedTime, mimeType, md5Checksum)',
+                                   query="'{}' in parents and trashed = false".format(parent_dir_id),
+                                   next_page_token=next_page_token,
+                                   page_size=REMOTE_PAGE_SIZE)
+        # the files of a page are handed over before the next page is requested
+        yield from results['files']
 
-    yield from results['files']
+        next_page_token = results.get('nextPageToken')
+        if not next_page_token:
+            return
 
 
 def list_remote_files_from_dir(service, parent_dir_id):
@@ -214,6 +283,93 @@ def list_remote_files_from_dir(service, parent_dir_id):
         yield each
 
 
+def prefetch(iterable, max_size):
+    """
+    Iterates the iterable on a background thread, so that the next items, e.g. the next
+    page of remote files, are fetched while the current ones are processed.
+    The background thread is started on the first next() and stops once the returned
+    generator is exhausted or closed.
+    Args:
+        iterable: An iterable, usually a generator which fetches from google drive
+        max_size: Integer, the max number of items fetched ahead
+    Returns:
+        A generator of the items of the iterable. An exception raised by the iterable
+        is re-raised by this generator.
+    """
+    items = queue.Queue(maxsize=max_size)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for each in iterable:
+                if not put((True, each)):
+                    return
+        except Exception as e:
+            put((False, e))
+        else:
+            put((False, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            has_item, value = items.get()
+            if not has_item:
+                if value is not None:
+                    raise value
+                return
+            yield value
+    finally:
+        stopped.set()
+
+
+def get_start_page_token(service):
+    """
+    Gets the google drive changes page token for the current state of the drive.
+    Args:
+        service: A googleapiclient.discovery.Resource object
+    Returns:
+        'A String' page token
+    """
+    return service.changes().getStartPageToken().execute()['startPageToken']
+
+
+def list_changes(service, page_token):
+    """
+    Lists the google drive changes made since the page token was taken.
+    Args:
+        service: A googleapiclient.discovery.Resource object
+        page_token: 'A String' page token from get_start_page_token or a previous list_changes
+    Returns:
+        A tuple of the list of changes and the page token for the next list_changes. A change has the format
+            {
+            'fileId': 'A String' id of the changed file
+            'removed': Boolean, whether the file is no longer accessible
+            'file': {'parents': A list of the parent dir ids}, not present for removed files
+            }
+    Raises:
+        googleapiclient.errors.HttpError with status 410 if the page token is expired
+    """
+    changes = []
+    while True:
+        results = service.changes().list(pageToken=page_token,
+                                         pageSize=1000,
+                                         fields='nextPageToken, newStartPageToken, '
+                                                'changes(fileId, removed, file(parents))').execute()
+        changes.extend(results['changes'])
+        if 'newStartPageToken' in results:
+            return changes, results['newStartPageToken']
+        page_token = results['nextPageToken']
+
+
 def get_remote_dir(service, parent_dir_id, dir_list):
     """
     Gets the remote dir id from drive.
@@ -260,12 +416,21 @@ def get_credentials():
 
 def get_service():
     """
+    The returned service can be shared between threads. httplib2.Http is not thread-safe,
+    so the requests built by the service are bound to an http object of the calling thread.
     Returns:
         A googleapiclient.discovery.Resource object with methods for interacting with the service.
     """
     credentials = get_credentials()
     http = credentials.authorize(httplib2.Http())
-    return discovery.build('drive', 'v3', http=http)
+    thread_local = threading.local()
+
+    def build_request(_http, *args, **kwargs):
+        if not hasattr(thread_local, 'http'):
+            thread_local.http = credentials.authorize(httplib2.Http())
+        return googleapiclient_http.HttpRequest(thread_local.http, *args, **kwargs)
+
+    return discovery.build('drive', 'v3', http=http, requestBuilder=build_request)
 
 
 def get_inode_no(path_to_file):
@@ -300,7 +465,21 @@ def delete_file_on_remote(remote_file_id, service=None):
         remote_file_id: 'A String' id of the file/directory from google drive
         service: A googleapiclient.discovery.Resource object
     """
-    check_and_get_service(service).files().delete(fileId=remote_file_id).execute()
+    build_delete_file_on_remote_request(check_and_get_service(service), remote_file_id).execute()
+
+
+def build_delete_file_on_remote_request(service, remote_file_id):
+    """
+    Builds the request for deleting the file/directory on google drive without
+    executing it, so that it can be added to an ApiBatch.
+
+    Args:
+        service: A googleapiclient.discovery.Resource object
+        remote_file_id: 'A String' id of the file/directory from google drive
+    Returns:
+        A googleapiclient.http.HttpRequest object
+    """
+    return service.files().delete(fileId=remote_file_id)
 
 
 def update_remote_file(remote_file_id, local_file_path, service=None):
@@ -314,7 +493,8 @@ def update_remote_file(remote_file_id, local_file_path, service=None):
     check_and_get_service(service).files().update(fileId=remote_file_id,
                                                   media_body=local_file_path,
                                                   media_mime_type=magic.from_file(local_file_path,
-                                                                                  True)).execute()
+                                                                                  True),
+                                                  fields='id').execute()
 
 
 def create_local_dir(dir_path):